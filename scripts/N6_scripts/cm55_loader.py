@@ -222,24 +222,16 @@ def main_cm55_loader(path_to_network_c:List[Path] = None,
             # error on compilation: exit
             return rv
     log(logging.INFO, f"Running the program")
-    rv = compiler.load_and_run()
+    try:
+        rv = compiler.load_and_run()
+    finally:
+        compiler.close()
     show_returncode("Running", rv)
     return rv
 
     return rv
 
 
-class PathConverter(argparse.Action):
-    """
-    Function returning a class subclassing argparse.Action
-    to be used ad action kw in parser.add_argument
-    This function convert a string to a Path (if the string exists)
-    """
-    def __call__(self, parser, args, values, option_string=None):
-            if values:
-                values = Path(values)
-            setattr(args, self.dest, values)
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Program to load data to the N6",
                                      epilog="Only temporary, for internal use...")
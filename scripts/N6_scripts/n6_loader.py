@@ -3,16 +3,20 @@ import logging
 import argparse
 from pathlib import Path
 from typing import List
+import os
 import subprocess
 import shutil
 import sys
+from functools import lru_cache
 from n6_utils_pkg.config_reader import ConfigReader, N6LoaderConfig
 from n6_utils_pkg.compilers import CompilerType, IARCompiler, GCCCompiler
-from n6_utils_pkg.intel_hex import IHex
+from n6_utils_pkg.intel_hex import IHex, raw_to_ihex
 from n6_utils_pkg.c_file import CFile
 
 ## Current script variable 
 TEMPLATE_PATH = "./cspy_n6_template.mac"
+# Max time to wait for the board reset to complete
+RESET_TIMEOUT_S = 30
 
 #default logger
 logger = logging.getLogger(__name__)
@@ -44,8 +48,9 @@ def set_logger():
         # add fh to logger
         logger.addHandler(fh)
 
-def log(level, msg):
-    logger.log(level, f"{log_indent}{msg}")
+def log(level, msg, *args):
+    # args are %-formatted by logging only if the record is emitted
+    logger.log(level, log_indent + msg, *args)
 
 def find_while_line(main_c: Path) -> int:
     i = 1
@@ -60,12 +65,17 @@ def find_while_line(main_c: Path) -> int:
     return 
 
 def convert_mem_files(memdir:Path, c_file:CFile, objcopy_path:Path=None) -> List[Path]:
-    """Converts memory files to hex using the offsets defined in the C-file"""
+    """Converts memory files to hex using the offsets defined in the C-file
+    objcopy is used if provided, otherwise the conversion is done by raw_to_ihex"""
     rv = []
     memprefix = "*"
     mempool_offsets = c_file.get_all_offsets()
-    mempool_suffixes = list(mempool_offsets.keys())
+    if not mempool_offsets:
+        log(logging.INFO, "No memory pools declared by %s -- skipping memory files scan", c_file.file.name)
+        return rv
     file_pfx = c_file.get_cname()
+    obj = objcopy_path.resolve() if objcopy_path else None
+    obj_str = str(obj) if obj else ""
     
     for mf in memdir.glob(f"**/{file_pfx}_{memprefix}"):
         # 폴더거나 확장자 없으면 건너뛰기
@@ -73,37 +83,40 @@ def convert_mem_files(memdir:Path, c_file:CFile, objcopy_path:Path=None) -> List
             continue
 
         mem_file_type = mf.suffixes[0][1:].upper()  # get memory pool from file extension
-        
-        if mem_file_type not in mempool_suffixes:
+        offset = mempool_offsets.get(mem_file_type)
+        if offset is None:
             continue
 
-        offset = mempool_offsets[mem_file_type]
-
-        if mf.suffix == '.raw':
-            obj = objcopy_path.resolve()
+        if mf.suffix == '.raw' and obj is None:
+            # No objcopy available: in-process conversion (same output)
+            output_name = mf.with_suffix('.hex')
+            log(logging.INFO, "raw -> ihex %s %s (offset %s)", mf.name, output_name.name, offset)
+            if raw_to_ihex(mf, output_name, int(offset, 0)) > 0:
+                rv.append(output_name)
+        elif mf.suffix == '.raw':
             output_name = mf.with_suffix('.hex')
             # --start-address  doesnt work
-            cmd = [obj, "--change-addresses", offset, "-Ibinary", "-Oihex", mf, output_name]
-            cmd_str = " ".join([str(k) for k in cmd]).replace(str(mf.parent / mf.stem), mf.stem).replace(str(obj), obj.name)
-            log(logging.INFO, cmd_str)
+            cmd = [obj_str, "--change-addresses", offset, "-Ibinary", "-Oihex", mf, output_name]
+            log(logging.INFO, "%s --change-addresses %s -Ibinary -Oihex %s %s", obj.name, offset, mf.name, output_name.name)
             #print(f"+ {mf} found -> converting to hex : {cmd}")
             v = subprocess.run(cmd, capture_output=True, shell=False)
-            if (IHex(output_name).get_data_size() != 0):
+            # objcopy writes every byte of the raw input: no need to re-parse the produced hex file
+            if v.returncode == 0 and mf.stat().st_size > 0:
                 rv.append(output_name)
             #print(v.returncode)
-        # elif mf.suffix == '.hex':
-        #     if (IHex(mf).get_data_size() != 0):
-        #         rv.append(mf)
-            #print(f"+ {mf} found")
         else:
             pass
             #print(f"- {mf} ignored")
     return rv
 
-def set_project_path(s:str, projdir: Path) -> str:
+@lru_cache(maxsize=None)
+def _ewarm_path(projdir: Path) -> str:
     exe_path = (projdir / "EWARM").resolve().as_posix()
-    exe_path = exe_path.replace("/", "\\\\")
-    return s.replace("$PROJ_DIR$", exe_path)
+    return exe_path.replace("/", "\\\\")
+
+
+def set_project_path(s:str, projdir: Path) -> str:
+    return s.replace("$PROJ_DIR$", _ewarm_path(projdir))
 
 
 def show_returncode(desc:str, rv:int):
@@ -115,10 +128,50 @@ def show_returncode(desc:str, rv:int):
         log(logging.ERROR, f"{desc} failed")
 
 
+def cube_cmd(path_to_cube: Path, port: str, *extras: str, sn: str = None) -> List[str]:
+    """Builds a CubeProgrammer command line: connection options (with the ST-Link serial number if any) followed by extras"""
+    cmd = [str(path_to_cube), '-q', '-c', f'port={port}']
+    if sn:
+        cmd.append(f"sn={sn}")
+    cmd.extend(extras)
+    return cmd
+
+
+def start_cube_cmd(cmd: List[str]) -> subprocess.Popen:
+    """Launches a CubeProgrammer command, its output is only captured (and logged) when DEBUG is enabled"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+def wait_cube_cmd(proc: subprocess.Popen, timeout: float = None) -> int:
+    """Waits for a command launched with start_cube_cmd, logs its output and returns its return code"""
+    try:
+        out, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        out, _ = proc.communicate()
+        log(logging.ERROR, "Command timed out after %ss", timeout)
+    if out is not None:
+        log(logging.DEBUG, out.decode('utf-8', errors='replace').replace("\r\n","\n"))
+    return proc.returncode
+
+
+def run_cube_cmd(cmd: List[str]) -> int:
+    """Runs a CubeProgrammer command and returns its return code"""
+    return wait_cube_cmd(start_cube_cmd(cmd))
+
+
 def safe_copy(src: Path, dst: Path):
     """Copy file only if the source exists, raise a FileNotFoundError otherwise"""
     if Path(src).exists():
-        shutil.copy2(src, str(dst))
+        if Path(dst).is_dir():
+            dst = Path(dst) / Path(src).name
+        # copyfile uses in-kernel copies (sendfile / fcopyfile / CopyFile) when available,
+        # only the timestamps are propagated (mtime is checked against the blobs file)
+        shutil.copyfile(src, dst)
+        st = os.stat(src)
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
     else:
         log(logging.ERROR, f"Copying {str(src)} failed (file does not exist)")
         raise FileNotFoundError(f"{str(src)} does not exists")
@@ -227,78 +280,84 @@ def main_n6_loader(path_to_network_c:List[Path] = None,
                     safe_copy(k_blob, path_to_network_in_project / k_blob.name)
     except FileNotFoundError:
         return 1
-    
-    # Extract memory pool info from ALL c-files
-    log(logging.INFO, f"Extracting information from c-files")
 
-    # 1. 처리할 모든 C 파일 리스트 구성
-    target_c_files = [pout] # 첫 번째 파일
+    # Reset the complete board (in background, the host-side work below does not depend on it)
+    log(logging.INFO, f"""Resetting the board...""")
+    cmd = cube_cmd(path_to_cube, port, 'mode=powerdown', 'freq=2000', 'ap=1', sn=stlink_sn)
+    log(logging.DEBUG, "Launching command: %s", " ".join(cmd))
+    reset_proc = start_cube_cmd(cmd)
+    try:
+        # Extract memory pool info from ALL c-files
+        log(logging.INFO, f"Extracting information from c-files")
+
+        # 1. 처리할 모든 C 파일 리스트 구성
+        target_c_files = [pout] # 첫 번째 파일
     
-    if path_to_network_c:
-        for k in path_to_network_c:
-            target_c_files.append(path_to_network_in_project / k.name)
+        if path_to_network_c:
+            for k in path_to_network_c:
+                target_c_files.append(path_to_network_in_project / k.name)
 
-    all_mem_hex_dumps = []
-    mp = None
+        all_mem_hex_dumps = []
+        mp = None
 
-    # 2. 루프를 돌며 모든 모델의 가중치 파일 변환
-    for c_file_path in target_c_files:
-        log(logging.INFO, f"Processing metadata from: {c_file_path.name}")
-        cf = CFile(str(c_file_path))
+        # 2. 루프를 돌며 모든 모델의 가중치 파일 변환
+        for c_file_path in target_c_files:
+            log(logging.INFO, "Processing metadata from: %s", c_file_path.name)
+            cf = CFile(str(c_file_path))
 
-        # Loader 정보는 한 번만 로드
-        if mp is None:
-            mp = cf.get_mpools()
-            mp.add_loaders(path_to_stldr)
+            # Loader 정보는 한 번만 로드
+            if mp is None:
+                mp = cf.get_mpools()
+                mp.add_loaders(path_to_stldr)
 
-        log(logging.INFO, f"Converting memory files for prefix: {c_file_path.stem}")
+            log(logging.INFO, "Converting memory files for prefix: %s", c_file_path.stem)
         
-        dumps = convert_mem_files(path_to_memorydumps, cf, path_to_objcopy)
-        all_mem_hex_dumps.extend(dumps)
+            dumps = convert_mem_files(path_to_memorydumps, cf, path_to_objcopy)
+            all_mem_hex_dumps.extend(dumps)
         
-    mem_hex_dumps = all_mem_hex_dumps
+        mem_hex_dumps = all_mem_hex_dumps
     
-    if not mem_hex_dumps: 
-        log(logging.ERROR, f"No memory file converted")
+        if not mem_hex_dumps: 
+            log(logging.ERROR, f"No memory file converted")
+    except BaseException:
+        # Do not leave the reset process behind when the host-side work fails
+        reset_proc.kill()
+        reset_proc.wait()
+        raise
     
-    # Reset the complete board
-    log(logging.INFO, f"""Resetting the board...""")
-    cmd = [str(path_to_cube), '-q', '-c', 'port='+port, 'mode=powerdown', 'freq=2000', 'ap=1']
-    if stlink_sn:
-        cmd.insert(cmd.index("port=SWD")+1, f"sn={stlink_sn}")
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    log(logging.DEBUG, f"Launching command: {' '.join(cmd)}")
-    log(logging.DEBUG, result.stdout.decode('utf-8').replace("\r\n","\n"))
+    # Wait for the board reset launched before the c-files processing
+    # (the powerdown reset always reports a failure: its return code is not checked)
+    rc = wait_cube_cmd(reset_proc, timeout=RESET_TIMEOUT_S)
+    log(logging.DEBUG, "Board reset return code: %d", rc)
     
     # Add memories
+    ram_files_to_load = []
     for mf in mem_hex_dumps:
         mem_file_type = mf.suffixes[0][1:]
         flshl = mp.get_loader(mem_file_type)
         hx = IHex(mf)
         size_kb = hx.get_data_size() / 1000
         if flshl:
-            cmd = [str(path_to_cube), '-q', '-c', 'port='+port, 'mode=hotplug', 'ap=1', '--extload', flshl, '--download', str(mf), "--verify"]
-            if stlink_sn:
-                cmd.insert(cmd.index("port=SWD")+1, f"sn={stlink_sn}")
+            cmd = cube_cmd(path_to_cube, port, 'mode=hotplug', 'ap=1', '--extload', flshl, '--download', str(mf), "--verify", sn=stlink_sn)
             
             if skip_extflash_prog:
                 log(logging.INFO, f"Skipping flashing memory {mem_file_type} -- {size_kb:,.3f} kB")
             else:
                 log(logging.INFO, f"Flashing memory {mem_file_type} -- {size_kb:,.3f}".replace(',', ' ') + " kB")
-                result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-                log(logging.DEBUG, f"Flashing memory command: {' '.join(cmd)}")
-                log(logging.DEBUG, result.stdout.decode('utf-8').replace("\r\n","\n"))
+                log(logging.DEBUG, "Flashing memory command: %s", " ".join(cmd))
+                rc = run_cube_cmd(cmd)
 
-                if result.returncode:
-                    log(logging.INFO, f"Flashing memory {mem_file_type} -- return code ERROR")
-                    return result.returncode
+                if rc:
+                    log(logging.INFO, "Flashing memory %s -- return code ERROR", mem_file_type)
+                    return rc
         else:
             if skip_ramdata_prog:
                 log(logging.INFO, f"""Not planning to load ram data {mem_file_type} -- {size_kb:,.3f}kB""")
             else:
                 log(logging.INFO, f"""Loading {mem_file_type} after program start -- {size_kb:,.3f}kB""")
-                compiler.add_memory_file_to_load(mem_file_type, Path(mf).resolve())
+                ram_files_to_load.append((mem_file_type, Path(mf).resolve()))
 
+    compiler.add_memory_files_to_load(ram_files_to_load)
     compiler.dump_macro_file()
     
     if not skip_build:
@@ -312,17 +371,14 @@ def main_n6_loader(path_to_network_c:List[Path] = None,
             return rv
 
     log(logging.INFO, f"Loading internal memories & Running the program")
-    rv = compiler.load_and_run()
+    try:
+        rv = compiler.load_and_run()
+    finally:
+        compiler.close()
     show_returncode("Loading memories", rv)
     return rv
 
 
-class PathConverter(argparse.Action):
-    def __call__(self, parser, args, values, option_string=None):
-            if values:
-                values = Path(values)
-            setattr(args, self.dest, values)
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Program to load data to the N6",
                                      epilog="Only temporary, for internal use...")
@@ -1,11 +1,20 @@
 from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from collections import Counter
 from dataclasses import dataclass, field
 from enum import Enum, auto
 from pathlib import Path
-from typing import Optional, Mapping, Tuple, List, Any
-import copy
-import json
+from typing import Optional, Mapping, Tuple, List, Any, Iterable, Iterator
 import re
+import sys
+try:
+    # orjson is optional (faster on large JSON files), fall back to the standard library otherwise
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# (size in bytes, suffix) of the units used by format_size, largest first
+_SIZE_UNITS = ((1 << 20, "MB"), (1 << 10, "kB"))
 
 def format_size(size: int) -> str:
     """
@@ -21,12 +30,34 @@ def format_size(size: int) -> str:
     str
         String representing the memory size with proper prefixes
     """
-    if size >= 1024 ** 2:
-        return f"""{size/(1024 ** 2):>10,.3f} MB"""
-    elif size >= 1024:
-        return f"""{size/1024:>10,.3f} kB"""
-    else:
-        return f"""{size:>10}  B"""
+    for threshold, unit in _SIZE_UNITS:
+        if size >= threshold:
+            return f"""{size/threshold:>10,.3f} {unit}"""
+    return f"""{size:>10}  B"""
+
+
+def parse_int(v: int|str) -> Optional[int]:
+    """
+    Returns the integer value of an int, a decimal string or a prefixed (0x...) string, None if it is not a number
+    """
+    if isinstance(v, int):
+        return v
+    try:
+        return int(v, 0)
+    except (ValueError, TypeError):
+        # int(v, 0) rejects decimal strings with leading zeros
+        return int(v) if isinstance(v, str) and v.isdigit() else None
+
+
+def resolve_buffer_links(list_to_resolve:List[int], buffers_by_id:Mapping[int, Buffer]):
+    """
+    Replaces (in place) the buffer IDs of the list by the corresponding Buffer objects
+    """
+    for i, b_id in enumerate(list_to_resolve):
+        try:
+            list_to_resolve[i] = buffers_by_id[b_id]
+        except KeyError as exc:
+            raise ValueError(f'Cannot find buffer with ID = {b_id}') from exc
 
 
 class EpochType(Enum):
@@ -38,18 +69,7 @@ class EpochType(Enum):
 
     @classmethod
     def parse(cls, s):
-        if s == "NODE_UNDEF":
-            return cls.UNDEFINED
-        elif s == "NODE_HW":
-            return cls.HARDWARE
-        elif s == "NODE_SW_HW":
-            return cls.MIXED
-        elif s == "NODE_SW":
-            return cls.SOFTWARE
-        elif s == "NODE_EC":
-            return cls.EPOCH_CTRL
-        else:
-            return cls.UNDEFINED
+        return cls._PARSE_MAP.get(s, cls.UNDEFINED)
 
     def __str__(self) -> str:
         return self.name
@@ -57,33 +77,34 @@ class EpochType(Enum):
     def __repr__(self) -> str:
         return self.name
 
+EpochType._PARSE_MAP = {
+    "NODE_UNDEF": EpochType.UNDEFINED,
+    "NODE_HW":    EpochType.HARDWARE,
+    "NODE_SW_HW": EpochType.MIXED,
+    "NODE_SW":    EpochType.SOFTWARE,
+    "NODE_EC":    EpochType.EPOCH_CTRL,
+}
+
 class BufferType(Enum):
     UNDEFINED  = auto()
     ACTIVATION = auto()
     WEIGHT     = auto()
 
     @classmethod
-    def parse(cls, s:bool):
-        if s == "activation":
-            return cls.ACTIVATION
-        elif s == "weight":
-            return cls.WEIGHT
-        else:
-            return cls.UNDEFINED
+    def parse(cls, s:str):
+        return cls._PARSE_MAP.get(s, cls.UNDEFINED)
     @classmethod
     def from_isparam(cls, s:bool):
-        if s is True:
-            return cls.WEIGHT
-        elif s is False:
-            return cls.ACTIVATION
-        else:
-            return cls.UNDEFINED
+        return cls._ISPARAM_MAP.get(s, cls.UNDEFINED)
 
     def __repr__(self) -> str:
         return self.name
     def __str__(self) -> str:
         return self.__repr__()
 
+BufferType._PARSE_MAP = {"activation": BufferType.ACTIVATION, "weight": BufferType.WEIGHT}
+BufferType._ISPARAM_MAP = {True: BufferType.WEIGHT, False: BufferType.ACTIVATION}
+
 class Address:
     """
     Represents an address (relative or absolute) and provide methods to handle both representations
@@ -92,34 +113,37 @@ class Address:
         RELATIVE = auto()
         ABSOLUTE = auto()
 
+    __slots__ = ("_offset", "_atype", "_base", "_base_symbol", "value")
     _offset: int
     _atype: AddrType
     _base: int
     _base_symbol: str
-    value:int       # Either a pure offset if the address type is relative or absolute value
+    value:int       # Either a pure offset if the address type is relative or absolute value (computed once)
 
     def __init__(self, base: Optional[int|str], offset:int):
         self._offset = offset
-        if base.isdigit() is True:
+        b = parse_int(base)
+        if b is not None:
             self._atype = Address.AddrType.ABSOLUTE
-            self._base = int(base)
+            self._base = b
             self._base_symbol = "ABSOLUTE ADDRESS"
         else:
             self._atype = Address.AddrType.RELATIVE
             self._base = 0
             self._base_symbol = base
-    
-    @property
-    def value(self):
         if self._atype == Address.AddrType.RELATIVE:
-            return self._offset
+            self.value = self._offset
         else:
-            return self._base + self._offset
+            self.value = self._base + self._offset
     
     def __add__(self, other:Address|int) -> Address:
         if isinstance(other, int):
-            o = copy.deepcopy(self)
-            o._offset += other
+            o = Address.__new__(Address)
+            o._offset = self._offset + other
+            o._atype = self._atype
+            o._base = self._base
+            o._base_symbol = self._base_symbol
+            o.value = self.value + other
             return o
         if self._atype != other._atype:
             raise ValueError("Cannot add an absolute and a relative address")
@@ -146,6 +170,38 @@ class MemoryMapping:
     """
     used_ranges: List[Tuple[int, int]] = field(default_factory=list)
 
+    @staticmethod
+    def _align_end(end: int) -> int:
+        # Round "end" up to the next 0x10 boundary (an already aligned end is kept as is)
+        return (end + 0x0F) & ~0x0F
+
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[Tuple[int, int]]) -> MemoryMapping:
+        """
+        Builds a mapping from (base, end) ranges with a single sort and merge sweep
+        (same result as calling add_range for each range)
+
+        Parameters
+        ----------
+        ranges : Iterable[Tuple[int, int]]
+            (start address, end address) of the ranges to add
+        """
+        merged = []
+        sorted_ranges = sorted((b, cls._align_end(e)) for b, e in ranges)
+        if not sorted_ranges:
+            return cls(merged)
+        # The range being merged is kept in locals, a tuple is only built when it is complete
+        cur_base, cur_end = sorted_ranges[0]
+        for base, end in sorted_ranges:
+            if base <= cur_end:
+                if end > cur_end:
+                    cur_end = end
+            else:
+                merged.append((cur_base, cur_end))
+                cur_base, cur_end = base, end
+        merged.append((cur_base, cur_end))
+        return cls(merged)
+
     def add_range(self, base: int, end: int):
         """
         Adds a new range in the mapping (possibly extending old existing ranges)
@@ -157,53 +213,23 @@ class MemoryMapping:
         end : int
             end address of the range to add
         """
-        # Set "end" to be aligned with 0x10
-        end = end + (0x10 - (end % 0x10))
-        # handle easy cases
-        if not self.used_ranges:
-            # empty list
-            self.used_ranges.append((base, end))
+        end = self._align_end(end)
+        # Insert the range at its sorted position, then merge it with the overlapping neighbours
+        ranges = self.used_ranges
+        idx = bisect_left(ranges, (base, end))
+        if idx > 0 and base <= ranges[idx - 1][1]:
+            # overlapping the previous range
+            idx -= 1
+            base = ranges[idx][0]
+            end = max(end, ranges[idx][1])
+            hi = idx + 1
         else:
-            # at least one element in the list
-            for idx, (i, j) in enumerate(self.used_ranges):
-                if base < i and end < i:
-                    # new range before the current index
-                    self.used_ranges.insert(idx, (base, end))
-                    break
-                elif base > j:
-                    if idx < len(self.used_ranges) - 1:
-                        # to be placed after the current range
-                        continue
-                    else:
-                        # last loop
-                        self.used_ranges.append((base, end))
-                else:
-                    # then it is overlapping a range...
-                    new_base = min(base, i)
-                    new_end = max(end, j)
-                    self.used_ranges[idx] = (new_base, new_end)
-                    break
-
-        # ensure there is no overlap, or merge ranges
-        continue_looping = True
-        while continue_looping:
-            if len(self.used_ranges) <= 1:
-                continue_looping = False
-                break
-            for k in range(1, len(self.used_ranges)):
-                if self.used_ranges[k][0] <= self.used_ranges[k - 1][1]:  # Overlap
-
-                    if self.used_ranges[k][1] >= self.used_ranges[k - 1][1]:  # Interesting overlap
-                        # @TODO Take into account addresses not aligned to 0x04 ?
-                        self.used_ranges[k - 1] = (self.used_ranges[k - 1][0], self.used_ranges[k][1])
-                        self.used_ranges.pop(k)
-                        break
-                    elif self.used_ranges[k][1] <= self.used_ranges[k - 1][1]:  # Should not happen
-                        self.used_ranges.pop(k)
-                        break
-
-            if k == len(self.used_ranges) - 1:
-                continue_looping = False
+            hi = idx
+        while hi < len(ranges) and ranges[hi][0] <= end:
+            # overlapping the next range(s)
+            end = max(end, ranges[hi][1])
+            hi += 1
+        ranges[idx:hi] = [(base, end)]
 
     def get_size(self) -> int:
         """Returns the size (in bytes) of the current memory mapping"""  # noqa: DAR101,DAR201,DAR401
@@ -230,6 +256,7 @@ class MemoryMapping:
 
         
 class InputModel:
+    __slots__ = ("name", "signature", "n_params", "size")
     name: str
     signature: str
     n_params: int
@@ -250,6 +277,7 @@ class InputModel:
 
 
 class Tool:
+    __slots__ = ("name", "version", "arguments", "environment", "input_model")
     name: str
     version: str
     arguments: str
@@ -283,13 +311,20 @@ class GraphEdge:
     ...
 
 
+# Prefix of the description of graph nodes, in front of the layer kind
+NODE_KIND_PREFIX = "Node kind="
+# Marker for values not computed yet (None being a valid value)
+_UNSET = object()
+
 class GraphNode:
+    __slots__ = ("name", "node_id", "inputs", "outputs", "scratchs", "subgraph_nodes", "macc", "mapping",
+                 "original_nodes", "description", "sw_functions", "_sw_layer", "_raw_subgraph", "_buffers_by_id")
     name: str
     node_id: int
     inputs: List[int]       # Input Buffer IDs
     outputs: List[int]      # Output Buffer IDs
     scratchs: List[int]     # Scratch Buffer IDs
-    subgraph_nodes: List[GraphNode]
+    subgraph_nodes: List[GraphNode]    # Parsed on first access
     macc: str
     mapping: EpochType
     original_nodes: str
@@ -299,29 +334,71 @@ class GraphNode:
     @classmethod
     def parse_dict(cls, d:Mapping[str,Any]) -> GraphNode:
         gn = GraphNode()
-        gn.name = d["name"]
+        gn.name = sys.intern(d["name"])
         gn.node_id = d["id"]
         gn.inputs = d["inputs"]
         gn.outputs = d["outputs"]
         gn.scratchs = d["scratchs"]
         gn.mapping = EpochType.parse(d["mapping"])
-        gn.description = d["description"]
+        gn.description = sys.intern(d["description"])
         gn.macc = d["macc"]
-        gn.subgraph_nodes = [GraphNode.parse_dict(gg) for gg in d["subgraph_nodes"]]
+        gn._sw_layer = _UNSET
+        # subgraph nodes are only parsed when accessed (see __getattr__)
+        gn._raw_subgraph = d["subgraph_nodes"]
+        gn._buffers_by_id = None
         return gn
 
+    def __getattr__(self, name:str) -> Any:
+        # Only called when the attribute is not set: parse the subgraph nodes on first access
+        # (the slots are read without going through __getattr__ again: they may not be set either,
+        # eg. node not built by parse_dict, or copy/pickle probing the object before its init)
+        if name == "subgraph_nodes":
+            try:
+                raw = object.__getattribute__(self, "_raw_subgraph")
+            except AttributeError:
+                raw = None
+            if raw is not None:
+                nodes = list(map(GraphNode.parse_dict, raw))
+                try:
+                    buffers_by_id = object.__getattribute__(self, "_buffers_by_id")
+                except AttributeError:
+                    buffers_by_id = None
+                if buffers_by_id is not None:
+                    for n in nodes:
+                        n.link_buffers(buffers_by_id)
+                self.subgraph_nodes = nodes
+                self._raw_subgraph = None
+                return nodes
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def link_buffers(self, buffers_by_id:Mapping[int, Buffer]):
+        """
+        Replaces the buffer IDs of inputs/outputs/scratchs by the Buffer objects
+        (subgraph nodes not parsed yet are linked when they get parsed)
+        """
+        resolve_buffer_links(self.inputs, buffers_by_id)
+        resolve_buffer_links(self.outputs, buffers_by_id)
+        resolve_buffer_links(self.scratchs, buffers_by_id)
+        self._buffers_by_id = buffers_by_id
+        if self._raw_subgraph is None:
+            for n in self.subgraph_nodes:
+                n.link_buffers(buffers_by_id)
+
     def get_sw_layer(self) -> str:
         """
         Return the name of the layer that is implemented in software (or None, otherwise)
         """
+        if self._sw_layer is not _UNSET:
+            return self._sw_layer
         if self.mapping == EpochType.SOFTWARE:
             # For software layers, details are found in the subgraph 1st node
             if self.description == "":
-                return self.subgraph_nodes[0].get_sw_layer()
+                self._sw_layer = self.subgraph_nodes[0].get_sw_layer()
             else:
-                return self.description.replace("Node kind=", "")
+                self._sw_layer = self.description.removeprefix(NODE_KIND_PREFIX)
         else:
-            return None
+            self._sw_layer = None
+        return self._sw_layer
 
     def get_sw_layers_from_mixed(self) -> List[Optional[str]]:
         if self.mapping == EpochType.MIXED:
@@ -329,39 +406,42 @@ class GraphNode:
             rv = []
             for n in self.subgraph_nodes:
                 if n.mapping == EpochType.SOFTWARE:
-                    rv.append(n.description.replace("Node kind=", ""))
+                    rv.append(n.description.removeprefix(NODE_KIND_PREFIX))
             return rv
         else:
             return [None]
 
+    def iter_nodes(self) -> Iterator[GraphNode]:
+        """
+        Iterates (depth-first, pre-order) over the current node and all the nodes of its subgraphs
+        """
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            yield n
+            stack.extend(reversed(n.subgraph_nodes))
+
     def get_node_by_name(self, s:str) -> Optional[GraphNode]:
         """
         Returns a node with the name as argument contained in the current node, or None (not found)
         """
-        if self.name == s:
-            return self
-        else:
-            for sn in self.subgraph_nodes:
-                v = sn.get_node_by_name(s)
-                if v is not None:
-                    return v
+        for n in self.iter_nodes():
+            if n.name == s:
+                return n
         return None
 
     def get_node_by_id(self, nid:str) -> Optional[GraphNode]:
         """
         Returns a node with the ID as argument contained in the current node, or None (not found)
         """
-        if self.node_id == nid:
-            return self
-        else:
-            for sn in self.subgraph_nodes:
-                v = sn.get_node_by_id(nid)
-                if v is not None:
-                    return v
+        for n in self.iter_nodes():
+            if n.node_id == nid:
+                return n
         return None
 
 
 class Graph:
+    __slots__ = ("name", "graph_id", "inputs", "outputs", "nodes", "edges", "_nodes_by_name", "_nodes_by_id")
     name: str
     graph_id: int
     inputs: List[int]       # Graph Input Buffer IDs
@@ -376,46 +456,58 @@ class Graph:
         g.graph_id = d["id"]
         g.inputs = d["inputs"]
         g.outputs = d["outputs"]
-        g.nodes = [GraphNode.parse_dict(gg) for gg in d["nodes"]]
+        g.nodes = list(map(GraphNode.parse_dict, d["nodes"]))
         g.edges = []
+        g._nodes_by_name = None
+        g._nodes_by_id = None
         return g
 
+    def _build_node_index(self):
+        """Indexes all the nodes of the graph (including subgraph nodes) by name and by ID"""
+        if self._nodes_by_name is not None:
+            return
+        self._nodes_by_name = {}
+        self._nodes_by_id = {}
+        for k in self.nodes:
+            for n in k.iter_nodes():
+                # first node found wins (same as a depth-first search)
+                self._nodes_by_name.setdefault(n.name, n)
+                self._nodes_by_id.setdefault(n.node_id, n)
+
     def get_epoch_summary(self) -> Mapping[EpochType, int]:
         """
         Returns the number of epochs of each type
         """
-        return {e: sum([n.mapping is e for n in self.nodes]) for e in EpochType}
+        c = Counter(n.mapping for n in self.nodes)
+        return {e: c[e] for e in EpochType}
 
     def get_epoch_sw_details(self) -> Mapping[str, int]:
-        v = [n.get_sw_layer() for n in self.nodes]
-        n_sw_epochs_by_name = {layer_name: sum([name==layer_name for name in v]) for layer_name in set(v)}
-        if None in n_sw_epochs_by_name:
-            n_sw_epochs_by_name.pop(None)
-        return n_sw_epochs_by_name
+        n_sw_epochs_by_name = Counter(n.get_sw_layer() for n in self.nodes)
+        n_sw_epochs_by_name.pop(None, None)
+        return dict(n_sw_epochs_by_name)
 
     def get_epoch_mixed_sw_details(self) -> Mapping[str, int]:
-        v = []
-        for n in self.nodes:
-            v += n.get_sw_layers_from_mixed()
-        n_sw_epochs_by_name = {layer_name: sum([name==layer_name for name in v]) for layer_name in set(v)}
-        n_sw_epochs_by_name.pop(None)
-        return n_sw_epochs_by_name
+        n_sw_epochs_by_name = Counter(name for n in self.nodes for name in n.get_sw_layers_from_mixed())
+        n_sw_epochs_by_name.pop(None, None)
+        return dict(n_sw_epochs_by_name)
 
     def get_node_by_id(self, id_node:int) -> GraphNode:
-        for k in self.nodes:
-            v = k.get_node_by_id(id_node)
-            if v is not None:
-                return v
-        raise ValueError(f"Cannot find node ID {id_node} in graph {self.name}")
+        self._build_node_index()
+        try:
+            return self._nodes_by_id[id_node]
+        except KeyError as exc:
+            raise ValueError(f"Cannot find node ID {id_node} in graph {self.name}") from exc
 
     def get_node_by_name(self, name_node:str) -> GraphNode:
-        for k in self.nodes:
-            v = k.get_node_by_name(name_node)
-            if v is not None:
-                return v
-        raise ValueError(f"Cannot find node {name_node} in graph {self.name}")
+        self._build_node_index()
+        try:
+            return self._nodes_by_name[name_node]
+        except KeyError as exc:
+            raise ValueError(f"Cannot find node {name_node} in graph {self.name}") from exc
 
 class Buffer:
+    __slots__ = ("name", "buffer_id", "alignment", "_mpool_id", "memory_pool", "_offset_start", "size_bytes",
+                 "buffer_type", "flags", "epochs", "shape", "format", "nbits", "qmn", "intq", "address", "abs_address")
     name: str
     buffer_id: int
     alignment: int
@@ -432,21 +524,23 @@ class Buffer:
     qmn: Mapping[str, int]
     intq: Mapping[str, Any]
     address: Address
+    abs_address: int        #  address.value, kept as a plain int (set by update_address)
 
     @classmethod
     def parse_dict(cls, d:Mapping[str,Any]) -> Buffer:
         v = cls()
-        v.name = d["name"]
+        # names, formats and flags are often shared by many buffers
+        v.name = sys.intern(d["name"])
         v.buffer_id = d["id"]
         v.alignment = d["alignment"]
         v._mpool_id = d["mpool_id"]      
         v._offset_start = d["offset_start"]
         v.size_bytes = d["size_bytes"]
         v.buffer_type = BufferType.from_isparam(d["is_param"])
-        v.flags = d["flags"]
+        v.flags = sys.intern(d["flags"]) if d["flags"] else d["flags"]
         v.epochs = d["epochs"]
         v.shape = d["shape"]
-        v.format = d["format"]
+        v.format = sys.intern(d["format"])
         v.nbits = d["nbits"]
         v.qmn = d["qmn"]
         #v.intq = d["intq"]
@@ -454,7 +548,23 @@ class Buffer:
 
     def update_address(self):
         self.address = self.memory_pool.address + self._offset_start
+        self.abs_address = self.address.value
     
+    def clone_for_split(self, mp:MemoryPool) -> Buffer:
+        """
+        Returns a shallow copy of the buffer attached to the memory pool given as argument
+        (the address is not updated)
+        """
+        nb = Buffer.__new__(Buffer)
+        for f in Buffer.__slots__:
+            try:
+                setattr(nb, f, getattr(self, f))
+            except AttributeError:
+                # field not set on the original buffer
+                pass
+        nb.memory_pool = mp
+        return nb
+
     def force_memory_pool(self, mp:MemoryPool):
         self.memory_pool = mp
         self.update_address()
@@ -467,6 +577,8 @@ class Buffer:
 
 class MemoryPool:
     # @TODO: implement (already done in the c-parsing package)
+    __slots__ = ("name", "mempool_id", "alignment", "address", "_offset_start", "size_bytes", "used_size_bytes",
+                 "buffers", "virtual", "memory_map_activations", "memory_map_weights", "_size_cache")
     name: str
     mempool_id: int
     alignment: int
@@ -486,32 +598,46 @@ class MemoryPool:
         v.name = d["name"]
         v.mempool_id = d["id"]
         v.alignment = d["alignment"]
-        v.address = d["address"]
         v._offset_start = d["offset_start"]
         v.size_bytes = d["size_bytes"]
         v.used_size_bytes = d["used_size_bytes"]
         v.buffers = d["buffers"]
+        v._size_cache = None
         if "virtual" in d:
             v.virtual = bool(d["virtual"])
         else:
             v.virtual = False
 
-        if v.address.isdigit():
+        base = parse_int(d["address"])
+        if base is not None:
             # The memory pool is absolute.
-            v.address = Address(v.address, v._offset_start)
+            v.address = Address(base, v._offset_start)
         else:
             # The memory pool is "relative"-addressed: use its name as the base symbol / offset_start should be 0
             v.address = Address(v.name, v._offset_start)
         return v
 
+    def _get_sizes_bytes(self) -> Tuple[int, int]:
+        """Returns (activations size, weights size), computed in a single pass and cached until a buffer is added"""
+        if self._size_cache is None:
+            a = w = 0
+            for b in self.buffers:
+                if b.buffer_type is BufferType.ACTIVATION:
+                    a += b.size_bytes
+                elif b.buffer_type is BufferType.WEIGHT:
+                    w += b.size_bytes
+            self._size_cache = (a, w)
+        return self._size_cache
+
     def get_activations_size_bytes(self) -> int:
-        return sum([b.size_bytes for b in self.buffers if b.buffer_type == BufferType.ACTIVATION])
+        return self._get_sizes_bytes()[0]
 
     def get_weights_size_bytes(self) -> int:
-        return sum([b.size_bytes for b in self.buffers if b.buffer_type == BufferType.WEIGHT])
+        return self._get_sizes_bytes()[1]
 
     def add_buffer(self, b:Buffer):
         self.buffers.append(b)
+        self._size_cache = None
 
     def add_buffer_by_split(self, b:Buffer):
         """
@@ -524,11 +650,11 @@ class MemoryPool:
         # Get "absolute" addresses if possible ( @TODO this is dirty, to be improved)
         mp_start = self.address.value
         mp_end = mp_start + self.size_bytes
-        b_start = b.address.value
+        b_start = b.abs_address
         b_end = b_start + b.size_bytes
         # case 1: b_start <= mp_start and b_end >= mp_end (buffer fully overlaps)
         if b_start <= mp_end and b_end >= mp_start:
-            ba = copy.deepcopy(b)
+            ba = b.clone_for_split(self)
             ba.name = ba.name + "__SPLIT__" + self.name
             # First, keep absolute addresses everywhere to compute sizes
             if b_start < mp_start:
@@ -542,8 +668,8 @@ class MemoryPool:
                 ba.size_bytes = mp_end - ba._offset_start
             # After computing sizes, remove "mp_start" from start offset of the buffer
             ba._offset_start -= mp_start
-            # Update memory pool associated with this split buffer
-            ba.force_memory_pool(self)
+            # Update the address of this split buffer (already associated with this memory pool)
+            ba.update_address()
             #print(f"Adding buffer {ba.name} after split to {self.name} [{ba.address.value:#x} - {ba.address.value + ba.size_bytes:#x}] size = {format_size(ba.size_bytes)}")
             self.add_buffer(ba)
         else:
@@ -551,15 +677,17 @@ class MemoryPool:
             pass
 
     def update_memory_map(self):
-        self.memory_map_weights = MemoryMapping()
-        self.memory_map_activations = MemoryMapping()
+        activations = []
+        weights = []
         for b in self.buffers:
-            b_s = b.address.value
+            b_s = b.abs_address
             b_e = b_s + b.size_bytes
             if b.buffer_type == BufferType.ACTIVATION:
-                self.memory_map_activations.add_range(b_s, b_e)
+                activations.append((b_s, b_e))
             elif b.buffer_type == BufferType.WEIGHT:
-                self.memory_map_weights.add_range(b_s, b_e)       
+                weights.append((b_s, b_e))
+        self.memory_map_activations = MemoryMapping.from_ranges(activations)
+        self.memory_map_weights = MemoryMapping.from_ranges(weights)
         #print(f"Updated memory mapping - {self.name}: {self.memory_map.get_size()/1000.0} kB")
 
     def __repr__(self) -> str:
@@ -575,7 +703,7 @@ class Environment:
     @classmethod
     def parse_dict(cls, d:Mapping[str,Any]) -> GraphNode:
         v = cls()
-        v.tools= [Tool.parse_dict(dd) for dd in d["tools"]]
+        v.tools= list(map(Tool.parse_dict, d["tools"]))
         v.generated_model = d["generated_model"]
         #v.network_signature = d["network_signature"]
         return v
@@ -617,14 +745,15 @@ class AtonJson:
 
     def __init__(self, filename:Path):
         self.filename = filename
-        self.data = json.loads(filename.read_bytes())
+        with filename.open("rb") as f:
+            self.data = json_loads(f.read())
         self._reorganize_data()
 
     def _reorganize_data(self):
         self.environment = Environment.parse_dict(self.data["environment"])
-        self.graphs = [Graph.parse_dict(g) for g in self.data["graphs"]]
-        self.buffers = [Buffer.parse_dict(g) for g in self.data["buffers"]]
-        self.memory_pools = [MemoryPool.parse_dict(g) for g in self.data["memory_pools"]]
+        self.graphs = list(map(Graph.parse_dict, self.data["graphs"]))
+        self.buffers = list(map(Buffer.parse_dict, self.data["buffers"]))
+        self.memory_pools = list(map(MemoryPool.parse_dict, self.data["memory_pools"]))
         # @TODO: Continue reading json data
         self._create_links()
         self._update_addresses()
@@ -633,50 +762,37 @@ class AtonJson:
         self._split_virtual_memory_buffers()
         pass
 
-    def _resolve_buffer_links(self, list_to_resolve:List[int], buffer_list: List[Buffer]):
-        buffers_id = [k.buffer_id for k in buffer_list]
-        for i, b_id in enumerate(list_to_resolve):
-            try:
-                idx = buffers_id.index(b_id)
-                list_to_resolve[i] = buffer_list[idx]
-            except ValueError as exc:
-                raise ValueError(f'Cannot find buffer with ID = {list_to_resolve[i]}') from exc
+    def _resolve_buffer_links(self, list_to_resolve:List[int], buffers_by_id: Mapping[int, Buffer]):
+        resolve_buffer_links(list_to_resolve, buffers_by_id)
 
     def _resolve_memory_pool_links(self):
-        memory_pools_id = [k.mempool_id for k in self.memory_pools]
+        memory_pools_by_id = {k.mempool_id: k for k in self.memory_pools}
         for b in self.buffers:
             try:
-                idx = memory_pools_id.index(b._mpool_id)
-                b.memory_pool = self.memory_pools[idx]
-            except ValueError as exc:
-                raise ValueError(f'Cannot find memory pool with ID = {b.mpool_id}') from exc
+                b.memory_pool = memory_pools_by_id[b._mpool_id]
+            except KeyError as exc:
+                raise ValueError(f'Cannot find memory pool with ID = {b._mpool_id}') from exc
 
     def _create_links(self):
         """
         For each element that  referencing other objects, resolve the link
         """
-        def resolve_node(node:GraphNode, b_list:List[Buffer]):
-            """Recursive resolving of buffer objects in graph nodes"""
-            self._resolve_buffer_links(node.inputs, b_list)
-            self._resolve_buffer_links(node.outputs, b_list)
-            self._resolve_buffer_links(node.scratchs, b_list)
-            for gn in node.subgraph_nodes:
-                resolve_node(gn, b_list)
+        buffers_by_id = {k.buffer_id: k for k in self.buffers}
 
         # Memory pools contains references to buffers
         for m in self.memory_pools:
-            self._resolve_buffer_links(m.buffers, self.buffers)
+            self._resolve_buffer_links(m.buffers, buffers_by_id)
 
         # Buffers contain references to Memory pools
         self._resolve_memory_pool_links()
 
         # Graph have buffers as inputs and outputs
         for g in self.graphs:
-            self._resolve_buffer_links(g.inputs, self.buffers)
-            self._resolve_buffer_links(g.outputs, self.buffers)
-            # Graph nodes have buffers input output
+            self._resolve_buffer_links(g.inputs, buffers_by_id)
+            self._resolve_buffer_links(g.outputs, buffers_by_id)
+            # Graph nodes (and their subgraph nodes, once parsed) have buffers input output
             for gn in g.nodes:
-                resolve_node(gn, self.buffers)
+                gn.link_buffers(buffers_by_id)
     
     def _update_addresses(self):
         # resolve addresses of all buffers (make them absolute if possible)
@@ -695,13 +811,18 @@ class AtonJson:
         (this is used to compute the size used for each memory pool)
         """
         to_delete = []
+        # Non-virtual memory pools sorted by start address, to only visit the ones a buffer can overlap
+        phys = sorted((mp for mp in self.memory_pools if mp.virtual is False), key=lambda mp: mp.address.value)
+        phys_starts = [mp.address.value for mp in phys]
         for vmp in self.memory_pools:
             if vmp.virtual is True:
                 to_delete.append(vmp)
                 for b in vmp.buffers:
                     # Split the buffer b into all mpools that are not virtual....
-                    for mp in self.memory_pools:
-                        if mp.virtual is False:
+                    b_start = b.abs_address
+                    b_end = b_start + b.size_bytes
+                    for mp in phys[:bisect_right(phys_starts, b_end)]:
+                        if mp.address.value + mp.size_bytes >= b_start:
                             mp.add_buffer_by_split(b)
         # Remove virtual memory pools
         for k in to_delete:
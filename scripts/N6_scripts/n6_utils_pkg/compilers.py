@@ -1,11 +1,12 @@
 from dataclasses import dataclass
 from enum import Enum, auto
+from functools import lru_cache
 import logging
 import os
 from pathlib import Path
 import re
 import subprocess
-from typing import Protocol
+from typing import List, Optional, Protocol, Tuple
 import time
 import platform
 import shlex
@@ -14,6 +15,49 @@ import shutil
 # Timeout in seconds when running a command. 15s is needed to load 1MB
 TIMEOUT_PROCESS = 300
 
+_IS_WINDOWS = platform.system().lower() == "windows"
+
+# Patterns used to edit the macro/command files
+_RE_TEMPLATE_LINE = re.compile(r"^## (.*)$", re.MULTILINE)     # template line (duplicated for each memory file)
+_RE_HASH_LINES = re.compile(r"^##.*$", re.MULTILINE)           # remaining template lines
+_RE_WHITESPACE = re.compile(r"\s")
+_RE_XCL_QUOTED = {}     # "quoted path ending with <end>" patterns, by <end>
+
+# "/" -> "\\" (escaped, as written in the IAR .mac files) and "/" -> "\" (gdb on windows)
+_IAR_PATH_TABLE = str.maketrans({"/": r"\\"})
+_GDB_PATH_TABLE = str.maketrans({"/": "\\"})
+
+# .xcl files already verified: (path, size, mtime_ns)
+_XCL_VERIFIED: set = set()
+
+
+@lru_cache(maxsize=32)
+def _read_template(resolved_path: str, mtime_ns: int) -> str:
+    """Reads a debugger template (cached, the mtime is part of the key so that an edited template is re-read)"""
+    return Path(resolved_path).read_text()
+
+
+def expand_memory_files(macro_text: str, entries: List[Tuple[str, str]]) -> str:
+    """
+    Duplicates the template lines ("## ...") of `macro_text` once per entry, then fills the
+    ##RAMNAME##/##RAMFILE## placeholders in order with the (name, path) entries
+    The template lines are kept at the end for further additions
+    """
+    if not entries:
+        return macro_text
+    n = len(entries)
+    ss = _RE_TEMPLATE_LINE.sub(lambda m: f"  {m[1]}\n" * n + f"## {m[1]}", macro_text)
+    for memory_name, memory_path in entries:
+        ss = ss.replace("##RAMNAME##", memory_name, 1)
+        ss = ss.replace("##RAMFILE##", memory_path, 1)
+    return ss
+
+
+def read_template(path: Path) -> str:
+    """Returns the text of the debugger template at `path`"""
+    p = path.resolve()
+    return _read_template(str(p), p.stat().st_mtime_ns)
+
 
 class CompilerType(Enum):
     IAR = auto()
@@ -40,13 +84,15 @@ class Compiler(Protocol):
     launch_timeout: int
     st_link_sn: str
 
-    def compile_project(self, clean:bool = False) -> int:
+    def compile_project(self, clean:bool = False, parallel:Optional[int] = None) -> int:
         """Compiles the project for the current compiler
 
         Parameters
         ----------
         clean : bool
             If True, cleans the project before compiling
+        parallel : int
+            Number of parallel build jobs (default: the compiler default, see the implementations)
 
         Returns
         -------
@@ -66,6 +112,12 @@ class Compiler(Protocol):
         """
         ...
 
+    def close(self) -> None:
+        """
+        Stops the helper processes started by load_and_run (if any)
+        """
+        ...
+
     def add_memory_file_to_load(self, memory_name: str, memory_path: Path) -> None:
         """
         Add a memory file to load to the macro file that is launched before "running"
@@ -80,6 +132,17 @@ class Compiler(Protocol):
         """
         ...
 
+    def add_memory_files_to_load(self, entries: List[Tuple[str, Path]]) -> None:
+        """
+        Same as add_memory_file_to_load for several memory files at once
+
+        Parameters
+        ----------
+        entries : List[Tuple[str, Path]]
+            (name of the memory range, path to the memory file) to load, in order
+        """
+        ...
+
     def add_breakpoint_to_main_macro(self, lineno: int) -> None:
         """
         Replaces the placeholder of the template macro file for breakpoint
@@ -112,7 +175,12 @@ class IARCompiler:
     def __post_init__(self) -> None:
         self.path_to_main = self.path_to_project / "Src" / "main.c"
         self.path_to_cspy_out = self.path_to_project / "EWARM" / "n6.mac"
-        self.macro_text = self.path_to_debugger_template.resolve().read_text()
+        self._path_to_cspy_out_resolved = self.path_to_cspy_out.resolve()
+        # IAR install paths referenced by the .xcl files
+        iar_arm_dir = self.path_to_compiler_binary.parent / ".." / ".." / "arm"
+        self._arm_bin_path = (iar_arm_dir / "bin").resolve()
+        self._arm_dbg_cfg_path = (iar_arm_dir / "CONFIG" / "debugger" / "ST").resolve()
+        self.macro_text = read_template(self.path_to_debugger_template)
 
     @classmethod
     def get_compiler_exe(cls) -> str:
@@ -121,25 +189,30 @@ class IARCompiler:
         """
         return "iarbuild.exe"
     
-    def compile_project(self, clean:bool = False) -> int:
+    def compile_project(self, clean:bool = False, parallel:Optional[int] = None) -> int:
         project_file = self.path_to_project / "EWARM" / (self.project_name + ".ewp")
         # use the first project file found
-        cmd = [self.path_to_compiler_binary, project_file, "-make", self.project_config_name, '-log', 'all']
+        # Use all the cores, unless told otherwise
+        cmd = [self.path_to_compiler_binary, project_file, "-make", self.project_config_name, '-log', 'all',
+               "-parallel", str(parallel or os.cpu_count() or 1)]
         if clean is True:
             # "rebuild": the default -make only compiles changes, -build cleans first, then rebuilds
             cmd[2] = "-build"
         cmd = [str(c) for c in cmd]
-        self.logger(logging.DEBUG, f"Compiling project with command: {' '.join([str(k) for k in cmd])}")
-        v = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-        with Path("compile.log").open('w') as f:
-            f.write(v.stdout.decode('utf-8').replace("\r\n","\n"))
+        self.logger(logging.DEBUG, f"Compiling project with command: {' '.join(cmd)}")
+        # Stream the build output straight to the log file
+        with Path("compile.log").open('wb') as f:
+            v = subprocess.run(cmd, stdout=f, stderr=subprocess.STDOUT, shell=False)
         return v.returncode
     
     def load_and_run(self) -> int:
 
         def change_path_ending_with(end:str, replacement:Path, to_search:str) -> str:
             out_s = to_search
-            for k in re.findall(f"\"(.*{end})\"", to_search):
+            pattern = _RE_XCL_QUOTED.get(end)
+            if pattern is None:
+                pattern = _RE_XCL_QUOTED.setdefault(end, re.compile(f"\"(.*{re.escape(end)})\""))
+            for k in pattern.findall(to_search):
                 out_s = out_s.replace(k, str(replacement / end))
             return out_s
         def verify_general_xcl(f:Path):
@@ -152,19 +225,24 @@ class IARCompiler:
             f : Path
                 Path to the .xcl file
             """
+            st = f.stat()
+            # The patch depends on the install paths too: a file verified for another toolchain must be re-checked
+            key = (str(f), str(self._arm_bin_path), str(self.path_to_project))
+            if key + (st.st_size, st.st_mtime_ns) in _XCL_VERIFIED:
+                return
             s = f.read_text()
             s_out = s
-            arm_binaries_path = (self.path_to_compiler_binary.parent / ".." / ".." / "arm" / "bin").resolve()
+            arm_binaries_path = self._arm_bin_path
             s_out = change_path_ending_with("armPROC.dll", arm_binaries_path, s_out)
             s_out = change_path_ending_with("armSTLINK.dll", arm_binaries_path, s_out)
             s_out = change_path_ending_with("armbat.dll", arm_binaries_path, s_out)
             s_out = change_path_ending_with("Project.out", self.path_to_project / "EWARM" / self.project_config_name / "Exe", s_out)
             s_out = change_path_ending_with("n6.mac", self.path_to_project / "EWARM" , s_out)
-            m = re.match(r".*^\"(?P<O_FILE>.*?\.out)\".*?\n.*^--macro=\"(?P<MAC_FILE>.*?)\"", s, flags=re.MULTILINE|re.DOTALL)
             if s_out != s:
-                with f.open("w") as fop:
-                    self.logger(logging.WARNING, f"Patching general.xcl file")
-                    fop.write(s_out)
+                self.logger(logging.WARNING, f"Patching general.xcl file")
+                f.write_text(s_out)
+                st = f.stat()
+            _XCL_VERIFIED.add(key + (st.st_size, st.st_mtime_ns))
             
         def verify_driver_xcl(f:Path):
             """
@@ -176,19 +254,23 @@ class IARCompiler:
             f : Path
                 Path to the .xcl file
             """
+            st = f.stat()
+            key = (str(f), str(self._arm_dbg_cfg_path))
+            if key + (st.st_size, st.st_mtime_ns) in _XCL_VERIFIED:
+                return
             s = f.read_text()
             s_out = s
-            arm_dbg_config_path = (self.path_to_compiler_binary.parent / ".." / ".." / "arm" / "CONFIG" / "debugger" / "ST").resolve()
-            s_out = change_path_ending_with("STM32N6xxx0.ddf", arm_dbg_config_path, s_out)
+            s_out = change_path_ending_with("STM32N6xxx0.ddf", self._arm_dbg_cfg_path, s_out)
             if s_out != s:
-                with f.open("w") as fop:
-                    self.logger(logging.WARNING, f"Patching driver.xcl file")
-                    fop.write(s_out)
+                self.logger(logging.WARNING, f"Patching driver.xcl file")
+                f.write_text(s_out)
+                st = f.stat()
+            _XCL_VERIFIED.add(key + (st.st_size, st.st_mtime_ns))
 
         xcldir = self.path_to_project / "EWARM" / "settings"
-        xcls = [f for f in xcldir.glob(f"**/*.xcl")]
-        # filter xcls to only use the ones with the proper project
-        xcls = [k for k in xcls if re.match(rf"{self.project_name}\.{self.project_config_name}\.(?:driver|general)", k.name)]
+        # only look for the xcls of the proper project
+        patterns = [f"**/{self.project_name}.{self.project_config_name}.{kind}.xcl" for kind in ("driver", "general")]
+        xcls = [f for pat in patterns for f in xcldir.glob(pat)]
 
         generalxcl = ""
         backendxcl = ""
@@ -222,25 +304,26 @@ class IARCompiler:
         """
         (the link is written as a windows path with backslashes as iar seems to have issues
         with other formats)"""
-        # Duplicate template line
-        ss = re.sub(r"^## (.*)$", r"  \1\n## \1", self.macro_text, flags=re.MULTILINE)
+        self.add_memory_files_to_load([(memory_name, memory_path)])
+
+    def add_memory_files_to_load(self, entries: List[Tuple[str, Path]]) -> None:
         # Compute path to hex file with \\ only (MAC files seems not to handle /)
-        sanitized_path = memory_path.as_posix().replace("/",r"\\\\")
-        # Proceed with replacements
-        ss = re.sub(r"##RAMNAME##", memory_name, ss, count = 1)
-        ss = re.sub(r"##RAMFILE##", sanitized_path, ss, count = 1 )
-        self.macro_text = ss
+        entries = [(memory_name, memory_path.as_posix().translate(_IAR_PATH_TABLE)) for memory_name, memory_path in entries]
+        self.macro_text = expand_memory_files(self.macro_text, entries)
     
     def add_breakpoint_to_main_macro(self, lineno: int) -> None:
         """Replaces the ##BREAKLINE## placeholder by a line number (str)"""
         self.macro_text = self.macro_text.replace("##BREAKLINE##", str(lineno))
 
+    def close(self) -> None:
+        # No helper process
+        pass
+
     def dump_macro_file(self) -> None:
         self.macro_text = self.macro_text.replace("$PROJ_DIR$\\\\STM32N657xx",(self.path_to_project / "EWARM" / self.project_config_name).as_posix().replace("/","\\\\"))
-        self.macro_text = re.sub("^##.*$", "",self.macro_text, flags=re.MULTILINE)
-
-        with self.path_to_cspy_out.resolve().open('w') as f:
-            f.write(self.macro_text)
+        if "##" in self.macro_text:
+            self.macro_text = _RE_HASH_LINES.sub("", self.macro_text)
+        self._path_to_cspy_out_resolved.write_text(self.macro_text)
 
 @dataclass
 class GCCCompiler:
@@ -261,22 +344,29 @@ class GCCCompiler:
     def __post_init__(self) -> None:
         self.path_to_main = self.path_to_project / "Src" / "main.c"
         self.path_to_command_out = self.path_to_project / "armgcc" / "n6_commands.gdb"
+        self._path_to_command_out_resolved = self.path_to_command_out.resolve()
         self.path_to_cube_programmer = self.path_to_cube_programmer.parent
-        self.macro_text = self.path_to_debugger_template.resolve().read_text()
+        self.macro_text = read_template(self.path_to_debugger_template)
         # @ TODO : ensure this is mandatory (calling <executable> without the .exe extension on windows seems to work)
-        self._gdb_server_exe = self.path_to_gdb_server.resolve()/ self.get_debugger_server_exe()
-        self._gdb_exe = self.path_to_compiler_binary.parent.resolve() / self.get_debugger_exe()
+        gdb_server_dir = os.path.realpath(self.path_to_gdb_server)
+        gcc_dir = os.path.realpath(self.path_to_compiler_binary.parent)
+        self._gdb_server_exe = Path(os.path.join(gdb_server_dir, self.get_debugger_server_exe()))
+        self._gdb_exe = Path(os.path.join(gcc_dir, self.get_debugger_exe()))
         # Ensure computed executable paths exist
         for p,s in zip([self._gdb_server_exe, self._gdb_exe], ["GDB server", "GCC"]):
-            if not p.exists():
-                raise FileNotFoundError(f"Executable {p} does not exist. Please check the path to the {s} binaries.")
+            try:
+                os.stat(p)
+            except OSError:
+                raise FileNotFoundError(f"Executable {p} does not exist. Please check the path to the {s} binaries.") from None
+        # GDB server started by load_and_run (stopped by close)
+        self._gdbserver_proc: Optional[subprocess.Popen] = None
 
     @classmethod
     def get_debugger_server_exe(cls) -> str:
         """
         Returns the name of the debug server executable
         """
-        if platform.system().lower() == "windows":
+        if _IS_WINDOWS:
             return "ST-LINK_gdbserver.exe"
         else:
             return "ST-LINK_gdbserver"
@@ -286,30 +376,34 @@ class GCCCompiler:
         """
         Returns the name of the debugger executable
         """
-        if platform.system().lower() == "windows":
+        if _IS_WINDOWS:
             return "arm-none-eabi-gdb.exe"
         else:
             return "arm-none-eabi-gdb"
         
-    def compile_project(self, clean:bool = False) -> int:
+    def compile_project(self, clean:bool = False, parallel:Optional[int] = None) -> int:
         targets = ["all"]
         if clean is True:
             # Call the clean target before building all
             targets.insert(0, "clean")
-        cmd = [str(self.path_to_make), *targets, shlex.quote(f"GCC_PATH={self.path_to_compiler_binary.parent.as_posix()}"), shlex.quote(f"BUILD_CONF={self.project_config_name}")]
+        # make is serial unless parallel jobs are requested
+        jobs = [f"-j{parallel}"] if parallel is not None and parallel > 1 else []
+        cmd = [str(self.path_to_make), *jobs, *targets, shlex.quote(f"GCC_PATH={self.path_to_compiler_binary.parent.as_posix()}"), shlex.quote(f"BUILD_CONF={self.project_config_name}")]
         # Prepend the path to make in the PATH (as it may contain useful tools such as rm, mkdir, ...)
         env = os.environ.copy()
         env["PATH"] = str(self.path_to_make.parent) + os.pathsep + env["PATH"]
-        self.logger(logging.DEBUG, f"Compiling project with command: {' '.join([str(k) for k in cmd])}")
-        v = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=False, env=env, cwd=str((self.path_to_project/"armgcc").resolve()))
-        with Path("compile.log").open('w') as f:
-            f.write(' '.join([str(k) for k in cmd]))
-            f.write("\n\n")
-            f.write(v.stdout.decode('utf-8').replace("\r\n","\n"))
+        cmd_str = ' '.join(cmd)
+        self.logger(logging.DEBUG, f"Compiling project with command: {cmd_str}")
+        # Stream the build output straight to the log file (after the command line)
+        with Path("compile.log").open('wb') as f:
+            f.write((cmd_str + "\n\n").encode('utf-8'))
+            f.flush()
+            v = subprocess.run(cmd, stdout=f, stderr=subprocess.STDOUT, shell=False, env=env, cwd=str((self.path_to_project/"armgcc").resolve()))
         return v.returncode
     
-    def load_and_run(self) -> int:
-        # Launch GDB server first
+    def start_gdb_server(self) -> None:
+        """Launches the GDB server (the one of a previous load, if any, is stopped first)"""
+        self.close()
         cmd = [self._gdb_server_exe, "-d", "--frequency", "2000", "--apid", "1", "-v", 
                "--port-number", str(self.gdb_port_number), "-cp", self.path_to_cube_programmer.as_posix()]
         # Add serial number arguments for St-link if needed
@@ -317,7 +411,25 @@ class GCCCompiler:
             idx = cmd.index("--frequency")
             cmd = cmd[:idx]+ ["--serial-number", self.st_link_sn] + cmd[idx:]
         self.logger(logging.DEBUG, f"Starting gdbserver with command: {' '.join([str(k) for k in cmd])}")
-        subprocess.Popen(cmd,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        # Own session: a Ctrl-C in the console is not forwarded to the server, close() stops it
+        self._gdbserver_proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                                close_fds=True, start_new_session=True)
+
+    def close(self) -> None:
+        """Stops the GDB server"""
+        if self._gdbserver_proc is not None:
+            if self._gdbserver_proc.poll() is None:
+                self._gdbserver_proc.terminate()
+                try:
+                    self._gdbserver_proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._gdbserver_proc.kill()
+                    self._gdbserver_proc.wait()
+            self._gdbserver_proc = None
+
+    def load_and_run(self) -> int:
+        # Launch GDB server first
+        self.start_gdb_server()
         # Then call the debugger
         #cmd =  [self.path_to_compiler_binary.parent / "arm-none-eabi-gdb.exe", "-batch", f"--command={self.path_to_command_out.as_posix()}", (self.path_to_project/"armgcc"/"build"/"Project.elf").as_posix()]
         cmd =  [self._gdb_exe.as_posix(), "-batch",
@@ -332,38 +444,38 @@ class GCCCompiler:
         """
         (the link is written as a windows path with backslashes as iar seems to have issues
         with other formats)"""
-        # Duplicate template line
-        ss = re.sub(r"^## (.*)$", r"  \1\n## \1", self.macro_text, flags=re.MULTILINE)
-        # Compute path to hex file with \ only (gdb seems to prefer this syntax (and does not allows /)
-        sys_platform = platform.system()
-        if sys_platform == 'Windows': 
-            sanitized_path = memory_path.as_posix().replace("/",r"\\")
-        else:
-            sanitized_path = memory_path.as_posix()
-        # Ensure no spaces in paths, because restore does not work with spaces (gdb limitation, tried with quotes and escaping: did not work)
-        self.validate_gcc_args(sanitized_path)
-        self.validate_gcc_args(memory_name)
-        # Proceed with replacements
-        ss = re.sub(r"##RAMNAME##", memory_name, ss, count = 1)
-        ss = re.sub(r"##RAMFILE##", sanitized_path, ss, count =1 )
-        self.macro_text = ss
+        self.add_memory_files_to_load([(memory_name, memory_path)])
+
+    def add_memory_files_to_load(self, entries: List[Tuple[str, Path]]) -> None:
+        sanitized = []
+        for memory_name, memory_path in entries:
+            # Compute path to hex file with \ only (gdb seems to prefer this syntax (and does not allows /)
+            if _IS_WINDOWS:
+                sanitized_path = memory_path.as_posix().translate(_GDB_PATH_TABLE)
+            else:
+                sanitized_path = memory_path.as_posix()
+            # Ensure no spaces in paths, because restore does not work with spaces (gdb limitation, tried with quotes and escaping: did not work)
+            self.validate_gcc_args(sanitized_path)
+            self.validate_gcc_args(memory_name)
+            sanitized.append((memory_name, sanitized_path))
+        self.macro_text = expand_memory_files(self.macro_text, sanitized)
 
     def add_breakpoint_to_main_macro(self, lineno: int) -> None:
         """Replaces the ##BREAKLINE## placeholder by a line number (str)"""
         self.macro_text = self.macro_text.replace("##BREAKLINE##", str(lineno))
 
     def dump_macro_file(self) -> None:
-        self.macro_text = re.sub("^##.*$", "",self.macro_text, flags=re.MULTILINE)
+        if "##" in self.macro_text:
+            self.macro_text = _RE_HASH_LINES.sub("", self.macro_text)
         elf_path = (self.path_to_project / "armgcc" / "build"/ self.project_config_name / "Project.elf").as_posix()
         # Ensure project path has no spaces as it may be problematic when executing the macro file
         self.validate_gcc_args(elf_path)
         self.macro_text = self.macro_text.replace("build/Project.elf", elf_path)
         self.macro_text = self.macro_text.replace("127.0.0.1:61234", f"127.0.0.1:{self.gdb_port_number}")
-        with self.path_to_command_out.resolve().open('w') as f:
-            f.write(self.macro_text)
+        self._path_to_command_out_resolved.write_text(self.macro_text)
 
     def validate_gcc_args(self, s: str):
-        if re.search(r"\s", s):
+        if _RE_WHITESPACE.search(s):
             raise ValueError(f"When using GCC, paths should not contain spaces: {s}\nPlease consider using paths without spaces")
 
 
@@ -376,21 +488,18 @@ def run_with_timeout(cmd, loggr:logging.Logger, timeout: int):
     timeout     Timeout to stop the process
     """
     loggr(logging.DEBUG, f"Running command: {' '.join([str(k) for k in cmd])} with timeout {timeout}s")
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=False)
     start_time = time.monotonic()
-    elapsed_time = 0
-    # While the process is running
-    while process.poll() is None:
-        elapsed_time = int(time.monotonic() - start_time)
-        if elapsed_time > timeout:
-            loggr(logging.DEBUG, process.stdout.peek().decode('utf-8').replace("\r\n","\n"))
-            process.terminate()
-            loggr(logging.ERROR, f"Loading memories too long ({timeout}s)! Probably a crash of FW following an access to the external RAM/flash !")
-            loggr(logging.ERROR, "Fix the issue, reboot the board an try again.")
-            raise TimeoutError(f"Command {cmd} took more than {timeout} seconds")
-        time.sleep(1)  # Wait 1s for CPU
-
-    out, err = process.communicate()
+    try:
+        out, err = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.terminate()
+        out, err = process.communicate()
+        loggr(logging.DEBUG, out.decode('utf-8').replace("\r\n","\n"))
+        loggr(logging.ERROR, f"Loading memories too long ({timeout}s)! Probably a crash of FW following an access to the external RAM/flash !")
+        loggr(logging.ERROR, "Fix the issue, reboot the board an try again.")
+        raise TimeoutError(f"Command {cmd} took more than {timeout} seconds")
+    elapsed_time = int(time.monotonic() - start_time)
     loggr(logging.DEBUG, out.decode('utf-8').replace("\r\n","\n"))
     # Display elapsed time for a long loading more than 60s
     if elapsed_time > 60:
@@ -1,4 +1,5 @@
 import argparse
+from functools import lru_cache
 import json
 import os
 import re
@@ -7,9 +8,18 @@ import shutil
 from typing import Any, Mapping, Tuple, Optional
 import platform
 import logging
+try:
+    # orjson is optional (faster on large JSON files), fall back to the standard library otherwise
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 from n6_utils_pkg.compilers import CompilerType, GCCCompiler, IARCompiler, parse_compiler_type
 from n6_utils_pkg.cubeIDE_toolbox import CubeIDEToolBox
 
+# Location of the n6_loader.py / run_xxx.py scripts
+_SCRIPTS_DIR = Path(__file__).parents[1].resolve()
+_UNAME = platform.uname()
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 ch = logging.StreamHandler()
@@ -18,29 +28,50 @@ formatter = logging.Formatter('%(asctime)s  %(name)s -- %(message)s', datefmt='%
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
+# JSON strings (kept as is) or // comments (removed), in a single pass
+_JSONC_STRIP = re.compile(r'"(?:\\.|[^"\\])*"|//[^\n]*')
+
+def strip_json_comments(s:str) -> str:
+    """Removes the // comments of a JSON text (the // inside strings are kept)"""
+    if '//' not in s:
+        # Nothing to remove (most generated files)
+        return s
+    return _JSONC_STRIP.sub(lambda m: '' if m[0].startswith('//') else m[0], s)
+
+@lru_cache(maxsize=None)
+def _read_jsonc_cached(resolved_path:str, mtime_ns:int, size:int) -> str:
+    # mtime/size are only part of the cache key: a modified file is read again
+    # Only the (immutable) text is cached, each caller gets its own parsed objects
+    return strip_json_comments(Path(resolved_path).read_text())
+
 def parse_jsonc(filename:Path) -> Mapping[str, Any]:
-    if filename.exists():
-        s = filename.read_text()
-        # Remove comments
-        s = '\n'.join(l for l in s.split('\n') if not l.lstrip(' ').lstrip("\t").startswith('//'))
-        try:
-            data = json.loads(s)
-        except json.JSONDecodeError as e:
-            raise SyntaxError(f"Bad Json syntax ({e.msg}) at line: {s.splitlines()[e.lineno-1]}")
-    else:
-        raise FileNotFoundError(f"Cannot find required file {filename.resolve()}")
-    return data
+    """Parses a JSON file with // comments (the file text is cached, the returned data is a new object on each call)"""
+    try:
+        resolved = filename.resolve()
+        st = resolved.stat()
+    except OSError:
+        raise FileNotFoundError(f"Cannot find required file {filename.resolve()}") from None
+    s = _read_jsonc_cached(str(resolved), st.st_mtime_ns, st.st_size)
+    try:
+        return json_loads(s)
+    except json.JSONDecodeError as e:   # orjson.JSONDecodeError is a subclass
+        raise SyntaxError(f"Bad Json syntax ({e.msg}) at line: {s.splitlines()[e.lineno-1]}")
+
+@lru_cache(maxsize=None)
+def _which(name:str) -> Optional[str]:
+    """Cached shutil.which ($PATH is not expected to change while running)"""
+    return shutil.which(name)
 
 def get_default_tools_dir(d:Mapping[str, str]=None) -> Mapping[str, Any]:
     # Extract paths of the tools if they are found in $PATH / set it to None otherwise
     # Update the given dictionary with found paths if some entries are missing in the dictionary, if a dict is passed as argument.
-    gdb_s = shutil.which(GCCCompiler.get_debugger_server_exe())
-    gdb_b = shutil.which(GCCCompiler.get_debugger_exe())
-    iar_b = shutil.which(IARCompiler.get_compiler_exe())
-    obj_b = shutil.which("arm-none-eabi-objcopy") # no need to put ".exe" for windows -> this line is approximately os-agnostic 
-    cub_b = shutil.which("STM32_Programmer_CLI")
-    make_b= shutil.which("make")
-    cubi_b= shutil.which("stm32cubeide")
+    gdb_s = _which(GCCCompiler.get_debugger_server_exe())
+    gdb_b = _which(GCCCompiler.get_debugger_exe())
+    iar_b = _which(IARCompiler.get_compiler_exe())
+    obj_b = _which("arm-none-eabi-objcopy") # no need to put ".exe" for windows -> this line is approximately os-agnostic 
+    cub_b = _which("STM32_Programmer_CLI")
+    make_b= _which("make")
+    cubi_b= _which("stm32cubeide")
     c_type = "gcc"  # default = gcc because it is multiplatform...
     if (gdb_s is None or gdb_b is None) and (iar_b is not None):
         c_type = "iar"
@@ -73,8 +104,10 @@ def check_path_entry_ok(d: Mapping[str, str], key: str) -> None:
     rv = d.setdefault(key)
     if not rv:
         raise ValueError(f"Required config entry {key} does not exist")
-    if not Path(rv).exists():
-        raise ValueError(f"Path for entry {key} does not exist: {rv}")
+    try:
+        os.stat(rv)
+    except OSError:
+        raise ValueError(f"Path for entry {key} does not exist: {rv}") from None
 
 class ConfigReader:
     def __init__(self, tools_filename:Path):
@@ -95,20 +128,19 @@ class ConfigReader:
         """Ensures all keys work"""
         if "compiler_type" not in self.data:
             raise ValueError(f"Required config entry compiler_type does not exist")
-        else:
-            _ = parse_compiler_type(self.data["compiler_type"]) # This will raise an error if the compiler type is not known
+        ct = parse_compiler_type(self.data["compiler_type"]) # This will raise an error if the compiler type is not known
 
         # check for tools that are required anyways
         for k in ["objcopy_binary_path", "cubeProgrammerCLI_binary_path"]:
             check_path_entry_ok(self.data, k)
 
         # check for compiler binaries
-        if parse_compiler_type(self.data["compiler_type"]) == CompilerType.GCC:
+        if ct == CompilerType.GCC:
             check_path_entry_ok(self.data, "gdb_server_path")
             check_path_entry_ok(self.data, "gcc_binary_path")
             check_path_entry_ok(self.data, "make_binary_path")
             self.data["compiler_binary_path"] = self.data["gcc_binary_path"]
-        elif parse_compiler_type(self.data["compiler_type"]) == CompilerType.IAR:
+        elif ct == CompilerType.IAR:
             check_path_entry_ok(self.data, "iar_binary_path")
             self.data["compiler_binary_path"] = self.data["iar_binary_path"]
 
@@ -119,11 +151,12 @@ class ConfigReader:
         if ci_b is None:
             # Cannot use cube ide path (not provided or does not exist)
             return
-        if not Path(ci_b).exists():
+        p = Path(ci_b)
+        if not p.exists():
             logger.warning(f"Cube IDE path {ci_b} does not exist, either comment it or fix it in the config file. Ignoring it.")
             return
         # Cube IDE path exists, overwrite all tools by cubeIDE tools
-        cide = CubeIDEToolBox(cubeide_path=Path(ci_b))
+        cide = CubeIDEToolBox(cubeide_path=p)
         binaries_to_seek = (
             ("gdb_server_path", cide.gdb_server),
             ("gcc_binary_path", cide.gcc),
@@ -131,17 +164,20 @@ class ConfigReader:
             ("cubeProgrammerCLI_binary_path", cide.cube_programmer),
             ("make_binary_path", cide.make)
         )
-        p = Path(ci_b)
+        cwd = Path.cwd()
         for key, val in binaries_to_seek:
             if key in self.data.keys():
                 # Do not overwrite user values
                 logger.debug(f"Found {val} in cubeIDE install: {key} not overwritten because already provided by the user")
                 continue
+            val_abs = val.expanduser()
+            if not val_abs.is_absolute():
+                val_abs = cwd / val_abs
             if key in ["objcopy_binary_path", "cubeProgrammerCLI_binary_path", "make_binary_path"]:
-                self.data[key] = val.expanduser().absolute().as_posix()
+                self.data[key] = val_abs.as_posix()
             else:
                 # for gdb and gdbserver, provide path only (as IAR)
-                self.data[key] = val.parent.expanduser().absolute().as_posix()
+                self.data[key] = val_abs.parent.as_posix()
             logger.debug(f"Found {val.name} in <CUBE_IDE_PATH>/{val.relative_to(p)}, using it for {key}")
 
     def get_value(self, key:str) -> Any:
@@ -266,18 +302,17 @@ def get_args(config_file:str, default_args, args) -> Mapping[str, Any]:
     # For values provided neither in the CLI or the JSON, use default values
     for k, v in default_args.items():
         # get cli value from args 
-        cli_value = args.__getattribute__(v["dest"])
+        cli_value = getattr(args, v["dest"])
+        if cli_value is None and k in data:
+            # Value in the json and not overridden in the CLI: nothing to convert
+            continue
         if cli_value is not None:
             # CLI value is not none: override config file value / set value
             data[k] = v["atype"](cli_value)
         else:
-            if k not in data:
-                # Value not in the json: update it with default value
-                logger.debug(f"Setting default value for {k} to default: {v['val']}")
-                data[k] = v["atype"](v["val"])
-            else:
-                # Value in the json, don't override it with defaults
-                pass
+            # Value not in the json: update it with default value
+            logger.debug("Setting default value for %s to default: %s", k, v['val'])
+            data[k] = v["atype"](v["val"])
     return data
 class LoaderConfig():
     default_args={}
@@ -291,29 +326,26 @@ class LoaderConfig():
         return networkc_dir.resolve()
 
     @classmethod
+    @lru_cache(maxsize=None)
     def _get_c_project_default_path(cls) -> Path:
         ## Compute default values: (assume the script is in a pack or in the repo)
         # Default project:
-        scripts_dir = Path(__file__).parents[1].resolve()   # Location of the n6_loader.py
-        project_pack_dir = scripts_dir / ".." / ".." / "Projects" / "STM32N6570-DK" / "Applications" / "NPU_Validation"
-        project_repo_dir = scripts_dir / ".." / ".." / "Projects" / "NPU_Validation"
-        project_path = project_pack_dir.resolve()   # Use the "pack" location by default
+        project_pack_dir = _SCRIPTS_DIR / ".." / ".." / "Projects" / "STM32N6570-DK" / "Applications" / "NPU_Validation"
+        project_repo_dir = _SCRIPTS_DIR / ".." / ".." / "Projects" / "NPU_Validation"
+        project_path = project_pack_dir   # Use the "pack" location by default
         if not project_pack_dir.exists():
             if project_repo_dir.exists():   # But if the pack location does not exist and the repo location exists, use it
-                project_path = project_repo_dir.resolve()
-        return project_path
+                project_path = project_repo_dir
+        return project_path.resolve()
 
     @classmethod
-    def add_args(cls, parser:argparse.ArgumentParser) -> None:
-        """
-        Updates the parser with arguments specific to n6_loader
-        @TODO: make something cleaner maybe ...
-        """
+    @lru_cache(maxsize=None)
+    def _build_default_args(cls, cwd:str) -> Mapping[str, Any]:
+        """Builds the default arguments (once per class and working directory, as network.c is looked for in it)"""
         # Get default project path and network.c path
         project_path = cls._get_c_project_default_path()
         networkc_dir = cls._get_network_c_default_path()
-        # Build default arguments
-        cls.default_args = {
+        return {
             "network.c":          make_default_arg(value=networkc_dir, atype=Path, dest="n6l_nf", help_str=f"Location of the network file to add to the project (default: {str(networkc_dir)})"),
             "project_build_conf": make_default_arg(value="N6-DK",      atype=str,  dest="n6l_bc", help_str=f"Build config to use for the project (default: N6-DK)"),
             "project_path":       make_default_arg(value=project_path, atype=Path, dest="n6l_projectp", help_str=f"Location of the validation project (ends with NPU_Validation) (default: {str(project_path)})"),
@@ -321,6 +353,15 @@ class LoaderConfig():
             "skip_ram_data_programming":       make_default_arg(value=False, atype=bool, dest="n6l_skipr", help_str="Skip programming of all RAM memories (internal & external) (default:False)"),
             "skip_build":                      make_default_arg(value=False, atype=bool, dest="n6l_skipb", help_str="Skip copy and build steps in the process (default: False)")
         }
+
+    @classmethod
+    def add_args(cls, parser:argparse.ArgumentParser) -> None:
+        """
+        Updates the parser with arguments specific to n6_loader
+        @TODO: make something cleaner maybe ...
+        """
+        # Build default arguments
+        cls.default_args = cls._build_default_args(os.getcwd())
         # Add arguments to the CLI (default = None) to post-process default values afterwards
         arggrp = parser.add_argument_group(cls.config_type_name, cls.config_type_name + 'specific options')
         add_arg_from_default_args("--network-file", "-nf",      parser_obj=arggrp, dict_entry=cls.default_args["network.c"])
@@ -365,30 +406,28 @@ class CM55LoaderConfig(LoaderConfig):
         super().__init__(args)
     
     @classmethod
+    @lru_cache(maxsize=None)
     def _get_c_project_default_path(cls) -> Path:
         ## Compute default values: (assume the script is in a pack or in the repo)
         # Default project:
-        scripts_dir = Path(__file__).parents[1].resolve()   # Location of the n6_loader.py
-        project_pack_dir = scripts_dir / ".." / ".." / "Projects" / "STM32N6570-DK" / "Applications" / "CM55_Validation"
-        project_repo_dir = scripts_dir / ".." / ".." / "Projects" / "CM55_Validation"
-        project_path = project_pack_dir.resolve()   # Use the "pack" location by default
+        project_pack_dir = _SCRIPTS_DIR / ".." / ".." / "Projects" / "STM32N6570-DK" / "Applications" / "CM55_Validation"
+        project_repo_dir = _SCRIPTS_DIR / ".." / ".." / "Projects" / "CM55_Validation"
+        project_path = project_pack_dir   # Use the "pack" location by default
         if not project_pack_dir.exists():
             if project_repo_dir.exists():   # But if the pack location does not exist and the repo location exists, use it
-                project_path = project_repo_dir.resolve()
-        return project_path
+                project_path = project_repo_dir
+        return project_path.resolve()
 
 class ValidationToolsConfig():
     # Static attribut for all instances
     default_args={}
     @classmethod
-    def add_args(cls, parser:argparse.ArgumentParser) -> None:
-        """
-        Updates the parser with arguments specific to validation scripts
-        """
-        scripts_dir = Path(__file__).parents[1].resolve()   # Location of the run_xxx.py files
-        tools_pack_dir = scripts_dir / ".." / ".." / "Utilities"
-        st_ai_dir = scripts_dir / ".." / ".." / ".." / "stm.ai" / "new_root" / "src" / "scripts" / "st_ai_cli"
-        uname = platform.uname()
+    @lru_cache(maxsize=None)
+    def _build_default_args(cls) -> Mapping[str, Any]:
+        """Builds the default arguments (once, they only depend on the platform and the scripts location)"""
+        tools_pack_dir = _SCRIPTS_DIR / ".." / ".." / "Utilities"
+        st_ai_dir = _SCRIPTS_DIR / ".." / ".." / ".." / "stm.ai" / "new_root" / "src" / "scripts" / "st_ai_cli"
+        uname = _UNAME
         tools_pack_dir = tools_pack_dir / uname.system.lower()
         if uname.system.lower() in ["windows", "linux"]: 
             pass #default value=ok
@@ -400,7 +439,7 @@ class ValidationToolsConfig():
         tools_pack_dir = tools_pack_dir.resolve()
 
         # Set values by defaults of arguments (Create a dictionary with key:value)
-        cls.default_args = {
+        return {
             "stmai_python_path":    make_default_arg(value=st_ai_dir, atype=Path, dest="n6val_st_ai",           help_str=f"Location of st_ai.py (default: {str(st_ai_dir)})"),
             "stmai_binaries_path":  make_default_arg(value=tools_pack_dir, atype=Path, dest="n6val_binaries",   help_str=f"Location of the stmai binaries (default: {str(tools_pack_dir)})"),
             "models_pattern":       make_default_arg(value=".*tflite",      atype=str,  dest="n6val_pattern",   help_str=f"Pattern used to find models to process (default: *.tflite)"),
@@ -416,6 +455,13 @@ class ValidationToolsConfig():
             "batch":                make_default_arg(value=10, atype=int, dest="n6val_batch",           help_str="Batch number"),
             "st_link_sn":           make_default_arg(value=None, atype=str, dest="n6val_stlinksn",      help_str="ST-Link serial number to be used for validation on target"),
         }
+
+    @classmethod
+    def add_args(cls, parser:argparse.ArgumentParser) -> None:
+        """
+        Updates the parser with arguments specific to validation scripts
+        """
+        cls.default_args = cls._build_default_args()
         # Add arguments to the CLI (default = None) to post-process default values afterwards
         arggrp = parser.add_argument_group('Validation Tools', 'Validation tools specific options')
         add_arg_from_default_args("--stmai-binaries",      parser_obj=arggrp, dict_entry=cls.default_args["stmai_binaries_path"])
@@ -460,8 +506,8 @@ class NeuralArtJSON:
         self.filename = file_p
         data = file_p.read_text()
         # Remove lines(parts) that are not JSON compliant -- comments
-        data = re.sub(r"\s*//.*?$", "", data, flags=re.DOTALL|re.MULTILINE)
-        self.data = json.loads(data)
+        data = strip_json_comments(data)
+        self.data = json_loads(data)
     
     def get_profile(self, profile_name:str) -> Tuple[Path, Optional[str], str]:
         """Returns path to mpool/mdesc/compiler arguments"""
@@ -1,27 +1,78 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+import hashlib
+import json
+from operator import itemgetter
+import os
 from pathlib import Path
 import shutil
 import stat     # To check if a file is executable
 import subprocess
-from typing import List
+import tempfile
+import threading
+from typing import Dict, List, Tuple
 import logging
+import re
 
+try:
+    from n6_utils_pkg.fs_utils import iter_files
+except ImportError:
+    # Run as a script from the n6_utils_pkg directory
+    from fs_utils import iter_files
 
-# Setup logging
+
+# Setup logging (the console handler is only installed when run as a script, see __main__)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)    # <---- Change level here for verbosity...
-formatter = logging.Formatter('%(asctime)s  %(name)s -- %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
+logger.addHandler(logging.NullHandler())
+
+# Tools discovery results, by cubeIDE install (see CubeIDEToolBox.set_cubeide_path)
+CACHE_DIR = Path.home() / ".cache" / "n6_cubeide_toolbox"
+
+# Max number of plugin directories walked at the same time
+MAX_SCAN_THREADS = 8
+
+# (int) timestamp of a plugin: end of the plugin directory name, after the last point
+_RE_PLUGIN_TIMESTAMP = re.compile(r"[\\/]plugins[\\/][^\\/]+?\.(\d+)(?:[\\/]|$)")
+
+def _plugin_timestamp(path: Path) -> int:
+    """Returns the timestamp of the plugin containing path (0 if none)"""
+    m = _RE_PLUGIN_TIMESTAMP.search(str(path))
+    return int(m[1]) if m else 0
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """Makes dst an alias of src: hardlink, or symlink, or a copy when both are not possible (eg. another drive)"""
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(src.resolve(), dst)
+        return
+    except OSError:
+        pass
+    # copyfile uses the kernel zero-copy path (sendfile) when available, mode bits are not needed
+    shutil.copyfile(src, dst)
+
+def _run_tool(cmd) -> Tuple[int, str]:
+    """
+    Runs a command, its output (stdout+stderr) is spooled to a temporary file and only read back
+    if the command fails. Returns the return code and the output (empty on success)
+    """
+    with tempfile.TemporaryFile() as log_fp:
+        rv = subprocess.run(cmd, stdout=log_fp, stderr=subprocess.STDOUT, shell=False)
+        if rv.returncode == 0:
+            return rv.returncode, ""
+        log_fp.seek(0)
+        # Tools output may contain non UTF-8 bytes (eg. Windows code page)
+        return rv.returncode, log_fp.read().decode("utf-8", errors="replace")
 
 @dataclass
 class CubeIDE_Plugin():
     plugin_id: str = None               # ID of the plugin (internal name in this module)
     plugin_partial_name: str = None     # Part of the plugin dir to look for
-    _plugin_paths: List[Path] = field(default_factory=list) # possible locations of the plugin (temporary)
+    _plugin_paths: List[Tuple[int, Path]] = field(default_factory=list) # possible locations of the plugin, with their timestamp (temporary)
     executable_name: str = None         # Name of the executable to look for
     executable: Path = None             # Final executable path to use
 
@@ -29,16 +80,15 @@ class CubeIDE_Plugin():
         """
         Add a possible path to the plugin
         """
-        self._plugin_paths.append(path)
+        self._plugin_paths.append((_plugin_timestamp(path), path))
     
     def resolve_executable(self) -> None:
         if len(self._plugin_paths) == 0:
             raise FileNotFoundError(f"Tool {self.executable_name} not found")
-        # Retrieve the (int) timestamp part of a plugin path (end of the pathname after the last point)
-        get_timestamp= lambda p:int(p.parts[p.parts.index("plugins")+1].rsplit(".", 1)[1])
-        # Sort the plugin paths by the name of the plugin (to get the most recent one)
-        self._plugin_paths.sort(key=get_timestamp, reverse=True)
-        self.executable = self._plugin_paths[0]
+        if len(self._plugin_paths) > 1:
+            # Sort the plugin paths by the timestamp of the plugin (to get the most recent one)
+            self._plugin_paths.sort(key=itemgetter(0), reverse=True)
+        self.executable = self._plugin_paths[0][1]
         if len(self._plugin_paths) > 1:
             logger.debug(f"Multiple versions of {self.plugin_id} found, using the most recent one: {self.executable}")
 
@@ -49,9 +99,23 @@ class CubeIDEToolBox():
     gdb_server: Path
     gdb_client: Path
     cube_programmer: Path
+    make: Path
+    objcopy: Path
+    gcc: Path
     cubeide_path: Path
     gdb_server_portno: int
     __toollist__: List
+    _tools: Dict[str, CubeIDE_Plugin]
+
+    # Attribute set after the discovery -> tool ID
+    __toolattrs__ = {
+        "gdb_server": "gdb-server",
+        "gdb_client": "gdb",
+        "cube_programmer": "cubeprog",
+        "make": "make",
+        "objcopy": "objcopy",
+        "gcc": "gcc",
+    }
 
     def __init__(self, cubeide_path: Path = None):
         # Tools to discover w/o extension
@@ -63,6 +127,7 @@ class CubeIDEToolBox():
             CubeIDE_Plugin(plugin_id="make", plugin_partial_name="externaltools.make", executable_name="make"),
             CubeIDE_Plugin(plugin_id="cubeprog", plugin_partial_name="cubeprogrammer", executable_name="STM32_Programmer_CLI")
         ]
+        self._tools = {plugin.plugin_id: plugin for plugin in self.__toollist__}
         self.gdb_server_portno = 36789
         if cubeide_path is not None:
             self.set_cubeide_path(cubeide_path)
@@ -71,104 +136,168 @@ class CubeIDEToolBox():
         """
         Set the cubeIDE path to the tools
         """
-        def find_executable(base_p: Path):
-            """ Search for the executable in the identified plugin directory """
-            for p in base_p.glob("**/*"):
-                if (not p.is_file() or p.suffix not in [".exe", ""] or (p.stat().st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) == 0)):  # os.access(k, os.X_OK) seems not to work
-                    # Not an executable file
-                    continue
-                for plugin in self.__toollist__:
-                    if p.stem == plugin.executable_name:
-                        plugin.add_possible_path(p)
-                        logger.debug(f"Found {plugin.executable_name} at {p}")
-
         self.cubeide_path = cubeide_path
-        for p in (cubeide_path/"plugins").glob("*"):
-            for k in self.__toollist__:
-                if k.plugin_partial_name in p.name:
-                    find_executable(p)
+        if not self._load_cache():
+            self.discover_all()
 
-        # Ensure every tool is found or raise an error
-        for plugin in self.__toollist__:
-            try:
-                plugin.resolve_executable()
-            except FileNotFoundError as e:
-                logger.error(f"Tool {plugin.executable_name} not found")
-                raise FileNotFoundError(f"Cannot find all plugins in {cubeide_path}") from e 
+            # Ensure every tool is found or raise an error
+            for plugin in self.__toollist__:
+                try:
+                    plugin.resolve_executable()
+                except FileNotFoundError as e:
+                    logger.error(f"Tool {plugin.executable_name} not found")
+                    raise FileNotFoundError(f"Cannot find all plugins in {cubeide_path}") from e 
+            self._save_cache()
 
-    def get_tool_path(self, key):
-        for plugin in self.__toollist__:
-            if key == plugin.plugin_id:
-                if plugin.executable is None:
-                    raise RuntimeError("Tools discovery not done, call set_cubeide_path first")
-                # If the plugin is found, return the executable path
-                return plugin.executable
-        raise ValueError(f"Tool {key} not found (not provided as a tool to discover)")
+        # Tools as plain attributes (used to build every command line)
+        for attr, key in self.__toolattrs__.items():
+            setattr(self, attr, self._tools[key].executable)
+        # String forms of the tools used in the command lines
+        self._cube_programmer_str = str(self.cube_programmer)
+        self._cube_programmer_dir_str = str(self.cube_programmer.parent)
+        # External loader for external flash (of the stm32n6-dk)
+        self._external_loader_str = str(self.cube_programmer.parent / "ExternalLoader" / "MX66UW1G45G_STM32N6570-DK.stldr")
+        self._gdb_server_str = str(self.gdb_server)
+        self._gdb_client_str = str(self.gdb_client)
 
-    @property
-    def gdb_server(self) -> Path:
-        return self.get_tool_path("gdb-server")
+    def _cache_file_and_key(self):
+        """Returns the cache file of the cubeIDE path and the key of the current install (changes when plugins are added/removed)"""
+        cubeide_abs = str(self.cubeide_path.resolve())
+        st = os.stat(self.cubeide_path / "plugins")
+        cache_file = CACHE_DIR / (hashlib.blake2b(cubeide_abs.encode(), digest_size=8).hexdigest() + ".json")
+        return cache_file, [cubeide_abs, st.st_mtime_ns, st.st_size]
 
-    @property
-    def gdb_client(self) -> Path:
-        return self.get_tool_path("gdb")
+    def _load_cache(self) -> bool:
+        """Sets the tools from the cached discovery results, returns False if they are missing or outdated"""
+        try:
+            cache_file, key = self._cache_file_and_key()
+            cached = json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            return False
+        if cached.get("key") != key:
+            return False
+        tools = cached.get("tools", {})
+        if any(tools.get(plugin.plugin_id) is None for plugin in self.__toollist__):
+            return False
+        # Paths are stored relative to the cubeIDE path (given as relative or absolute by the caller)
+        executables = [self.cubeide_path / tools[plugin.plugin_id] for plugin in self.__toollist__]
+        if not all(e.exists() for e in executables):
+            return False
+        for plugin, e in zip(self.__toollist__, executables):
+            plugin.executable = e
+        logger.debug(f"Using cached tools discovery results from {cache_file}")
+        return True
 
-    @property
-    def cube_programmer(self) -> Path:
-        return self.get_tool_path("cubeprog")
+    def _save_cache(self) -> None:
+        """Stores the discovery results (best effort: errors are ignored)"""
+        try:
+            cache_file, key = self._cache_file_and_key()
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_name(cache_file.name + f".{os.getpid()}.tmp")
+            tmp_file.write_text(json.dumps({"key": key, "tools": {plugin.plugin_id: plugin.executable.relative_to(self.cubeide_path).as_posix() for plugin in self.__toollist__}}))
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logger.debug(f"Cannot write the tools discovery cache: {e}")
 
-    @property
-    def make(self) -> Path:
-        return self.get_tool_path("make")
+    def discover_all(self) -> None:
+        """
+        Looks for all the tools in a single pass over the plugins of the cubeIDE path
+        (a plugin directory shared by several tools, eg. gnu-tools-for-stm32, is only scanned once)
+        """
+        # Executable file names (w/ or w/o .exe extension) -> tool
+        name_map = {}
+        for plugin in self.__toollist__:
+            name_map[plugin.executable_name] = plugin
+            name_map[plugin.executable_name + ".exe"] = plugin
+        lock = threading.Lock()     # plugin directories are walked in parallel
 
-    @property
-    def objcopy(self) -> Path:
-        return self.get_tool_path("objcopy")
+        def find_executable(base_p: Path):
+            """ Search for the executable in the identified plugin directory """
+            for entry in iter_files(base_p):
+                # Name first (no syscall), then stat only the few candidates
+                plugin = name_map.get(entry.name)
+                if plugin is None:
+                    continue
+                # Single stat (cached by the DirEntry): regular file with an exec bit
+                mode = entry.stat().st_mode
+                if not stat.S_ISREG(mode) or (mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) == 0):  # os.access(k, os.X_OK) seems not to work
+                    # Not an executable file
+                    continue
+                p = Path(entry.path)
+                with lock:
+                    plugin.add_possible_path(p)
+                logger.debug(f"Found {plugin.executable_name} at {p}")
 
-    @property
-    def gcc(self) -> Path:
-        return self.get_tool_path("gcc")
+        # Single listing of the plugins directory, only the plugins matching a tool are walked
+        partial_names = {k.plugin_partial_name for k in self.__toollist__}
+        with os.scandir(self.cubeide_path/"plugins") as it:
+            plugin_dirs = [Path(entry.path) for entry in it
+                           if entry.is_dir() and any(name in entry.name for name in partial_names)]
+        # Newest plugins first, walked by batches in parallel (the walks are mostly waiting for the filesystem):
+        # stop after the first batch where every tool has a candidate, the most recent one has then been seen
+        plugin_dirs.sort(key=_plugin_timestamp, reverse=True)
+        if not plugin_dirs:
+            return
+        n_threads = min(MAX_SCAN_THREADS, len(plugin_dirs))
+        with ThreadPoolExecutor(max_workers=n_threads) as ex:
+            for i in range(0, len(plugin_dirs), n_threads):
+                list(ex.map(find_executable, plugin_dirs[i:i+n_threads]))
+                if all(plugin._plugin_paths for plugin in self.__toollist__):
+                    break
+
+    def get_tool_path(self, key):
+        plugin = self._tools.get(key)
+        if plugin is None:
+            raise ValueError(f"Tool {key} not found (not provided as a tool to discover)")
+        if plugin.executable is None:
+            raise RuntimeError("Tools discovery not done, call set_cubeide_path first")
+        return plugin.executable
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not set: tools accessed before the discovery
+        if name in self.__toolattrs__:
+            raise RuntimeError("Tools discovery not done, call set_cubeide_path first")
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
     def reset_board(self) -> None:
         """
         Reset the board using Cube Programmer CLI
         """
         logger.info("Resetting the board")
-        cmd = [self.cube_programmer, '-q', '-c', 'port=SWD', 'mode=powerdown', 'freq=2000', 'ap=1']
-        rv = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=False)
-        # Do not check return code as it will always fail
-        if rv.returncode != 0:
-            pass
-
-    def flash_board(self, file:Path, address: int) -> None:
-        """Flash the board using Cube Programmer CLI"""
+        cmd = [self._cube_programmer_str, '-q', '-c', 'port=SWD', 'mode=powerdown', 'freq=2000', 'ap=1']
+        # Do not check return code as it will always fail (output is never used)
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=False)
+
+    def flash_board(self, file:Path, address: int, verify: bool = True) -> None:
+        """Flash the board using Cube Programmer CLI (verify=False skips the read back of the flashed data)"""
         # Reset first
         self.reset_board()
         # Ensure the file is a ".bin" file (or create a temporary file...)
         tmp_file = None
         if file.suffix != ".bin":
             tmp_file = file.with_name(file.name + ".bin")
-            shutil.copy(file, tmp_file)
+            # Only the name matters (file is not modified): avoid copying the whole image
+            _link_or_copy(file, tmp_file)
         else:
             tmp_file = file
-        # External loader for external flash (of the stm32n6-dk)
-        external_loader = self.cube_programmer.parent / "ExternalLoader" / "MX66UW1G45G_STM32N6570-DK.stldr"
-        cmd = [self.cube_programmer, '-q', '-c', 'port=SWD', 'mode=hotplug', 'freq=2000', 'ap=1', '--extload', str(external_loader), '--download', str(tmp_file), hex(address), "--verify"]
+        cmd = [self._cube_programmer_str, '-q', '-c', 'port=SWD', 'mode=hotplug', 'freq=2000', 'ap=1', '--extload', self._external_loader_str, '--download', str(tmp_file), hex(address)]
+        if verify:
+            cmd.append("--verify")
         logger.info(f"Loading {file.name} to the board at address {hex(address)}")
-        rv = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=False)
+        returncode, output = _run_tool(cmd)
         if tmp_file != file:
             #cleanup
             tmp_file.unlink()
-        if rv.returncode != 0:
-            logger.error(f"Error while flashing the weights: {rv.stdout.decode()}")
+        if returncode != 0:
+            logger.error(f"Error while flashing the weights: {output}")
             raise RuntimeError("Error while flashing the weights")
 
     def _launch_gdb_server(self) -> None:
         # Start GDB Server
         # Popen is needed for background process
         logger.info("Starting GDB server")
-        cmd = [self.gdb_server, "-d", "--frequency", "2000", "--apid", "1", "-v", "--port-number", str(self.gdb_server_portno), "-cp", str(self.cube_programmer.parent)]
-        logger.debug(f'Command: {" ".join([str(k) for k in cmd])}')
+        cmd = [self._gdb_server_str, "-d", "--frequency", "2000", "--apid", "1", "-v", "--port-number", str(self.gdb_server_portno), "-cp", self._cube_programmer_dir_str]
+        logger.debug(f'Command: {" ".join(cmd)}')
         subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
     def launch_elf(self, file: Path) -> None:
@@ -177,7 +306,7 @@ class CubeIDEToolBox():
         # Start GDB Client (launch elf file provided)
         logger.info("Starting GDB client")
         cmd = [
-            self.gdb_client,
+            self._gdb_client_str,
             "-ex", f"target remote :{self.gdb_server_portno}",
             "-ex", "monitor reset",
             "-ex", "load",
@@ -185,10 +314,10 @@ class CubeIDEToolBox():
             "-ex", "quit",
             str(file)
         ]
-        logger.debug(f'Command: {" ".join([str(k) for k in cmd])}')
-        v = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=False)
-        if v.returncode != 0:
-            logger.error(f"Error while loading the ELF file: {v.stdout.decode()}")
+        logger.debug(f'Command: {" ".join(cmd)}')
+        returncode, output = _run_tool(cmd)
+        if returncode != 0:
+            logger.error(f"Error while loading the ELF file: {output}")
             return
 
     def attach(self, file: Path, start_debug:bool) -> None:
@@ -197,21 +326,15 @@ class CubeIDEToolBox():
         # Start GDB Client (attach to the board)
         logger.info("Starting GDB client")
         cmd = [
-            self.gdb_client,
+            self._gdb_client_str,
             "-ex", f"\"target remote 127.0.0.1:{self.gdb_server_portno}\"",
-            file
+            str(file)
         ]
         if start_debug is True:
             to_add = ["-ex", "\"monitor reset\"", "-ex", "load"]
             cmd[3:3] = to_add
         # make command for bash
-        cmd_cpy = cmd[:]
-        for i,k in enumerate(cmd_cpy):
-            if isinstance(k, Path):
-                #cmd_cpy[i] = str(k)
-                #cmd_cpy[i] = k.as_posix().replace("C:", "/c")
-                cmd_cpy[i] = str(k) #k.as_posix().replace("C:", "/c")
-        cmd_cpy = " ".join(cmd_cpy)
+        cmd_cpy = " ".join(cmd)
         logger.info(f'Run this to attach/debug: \n\n{cmd_cpy}\n\n')
 
     def show_tools(self) -> None:
@@ -245,7 +368,7 @@ def flash(args, toolbox: CubeIDEToolBox):
     except ValueError:
         logger.error(f"Invalid address: {args.address}")
         return
-    toolbox.flash_board(args.file, args.address)
+    toolbox.flash_board(args.file, args.address, verify=not args.no_verify)
     logger.info("Flashing done")
 
 def launch(args, toolbox: CubeIDEToolBox):
@@ -271,6 +394,7 @@ if __name__ == "__main__":
     # Flasher
     flash_parser = subparsers.add_parser("flash", help="Flash the file to the board")
     flash_parser.add_argument("--address", required=True,  help="Address to flash the file to")
+    flash_parser.add_argument("--no_verify", action="store_true", default=False, help="Do not read back the flashed data to verify it")
     flash_parser.set_defaults(func=flash)
     # Launcher
     launch_parser = subparsers.add_parser("launch", help="Launch the ELF file on the board")
@@ -283,8 +407,12 @@ if __name__ == "__main__":
     show_tools_parser = subparsers.add_parser("show_tools", help="Show the tools found in the CubeIDE path")
     show_tools_parser.set_defaults(func=lambda args, toolbox: toolbox.show_tools())
     args = parser.parse_args()
-    if args.verbose:
-        logger.setLevel(logging.DEBUG)
+    logger.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    formatter = logging.Formatter('%(asctime)s  %(name)s -- %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
     if args.subcommand in ["flash", "launch", "attach"]:
         # Ensure the file argument is provided
         assert_file_provided(args)
@@ -1,17 +1,24 @@
 from enum import Enum
 from pathlib import Path
 from dataclasses import dataclass
-import intelhex
-from typing import List, Tuple
-from functools import partial
+from typing import Dict, List, Tuple
+import bisect
 import logging
+import os
 import struct
 
 from n6_utils_pkg.c_file import CFile
+from n6_utils_pkg.fs_utils import iter_files
+from n6_utils_pkg.intel_hex import write_ihex
 
 logging.basicConfig(level=logging.DEBUG)
 DEFAULT_ALIGNMENT = 5 # Data aligned on 0x20 addresses
 
+# Packed structures (formats parsed once)
+_U32 = struct.Struct("<I")                      # zeros blob size, model blob header, table record offset
+_U8 = struct.Struct("<B")                       # flash image header
+_DATABLOB_HDR = struct.Struct("<4sIIIBB")       # magic, dest_addr, size, next, is_last, type
+
 def get_next_aligned_address(addr:int, alignment:int) -> int:
     """
     Returns the next address that is aligned with the given alignment arg
@@ -31,18 +38,16 @@ def get_next_aligned_address(addr:int, alignment:int) -> int:
     """
     # Alignment = nb of bits
     #print(f"{get_next_aligned_address(0x489764548,0x40):#x}")
-    if addr % (1<<alignment) == 0:
-        return addr
-    v = addr >> alignment
-    v += 1
-    v = v << alignment
-    return v
+    mask = (1 << alignment) - 1
+    return (addr + mask) & ~mask
 
-# Default alignment function
-align_addr = partial(get_next_aligned_address, alignment=DEFAULT_ALIGNMENT)
+_DEFAULT_ALIGN_MASK = (1 << DEFAULT_ALIGNMENT) - 1
 
-def bytes_to_dict(offset:int, data:bytes):
-    return {offset+i:k for i,k in enumerate(data)}
+def align_addr(addr:int) -> int:
+    """
+    Default alignment function (get_next_aligned_address with DEFAULT_ALIGNMENT)
+    """
+    return (addr + _DEFAULT_ALIGN_MASK) & ~_DEFAULT_ALIGN_MASK
 
 class DataBlob:
     """
@@ -65,9 +70,9 @@ class DataBlob:
 
     def __init__(self, filen: Path, blob_offset: int=None, destination_offset:int=None):
         self.data = filen.read_bytes()
-        # Handle the case where all values are zeros
-        if all(self.data) == 0:
-            self.data = struct.pack("<I", len(self.data))
+        # Handle the case where all values are zeros (bytes.count is a single C scan)
+        if self.data.count(0) == len(self.data):
+            self.data = _U32.pack(len(self.data))
             self.type = self.BlobType.TYPE_ZEROS
         else:
             self.type = self.BlobType.TYPE_STD
@@ -77,6 +82,7 @@ class DataBlob:
         self.next = 0                          # address of the next data blob
         self.padding_len = 0
         self.hdr_padding_len = 0
+        self.length = 0                        # full size of the dump (header and paddings do not depend on next/is_last)
         self.update_paddings()
     
     def set_next(self, next_offset:int):
@@ -86,11 +92,10 @@ class DataBlob:
         return self.blob_offset
     
     def get_length(self) -> int:
-        return len(self.dump())
+        return self.length
 
     def get_header(self, padding:bool=True) -> bytes:
-        data = b"--DATABLOB--" + struct.pack("<ccccIIBB", b"A", b"I", b"D", b"B", self.dest_addr, len(self.data), self.is_last, self.type.value)
-        data = struct.pack("<ccccIIIBB", b"A", b"I", b"D", b"B", self.dest_addr, len(self.data), self.next, self.is_last, self.type.value)
+        data = _DATABLOB_HDR.pack(b"AIDB", self.dest_addr, len(self.data), self.next, self.is_last, self.type.value)
         if padding is True:
             return data + b"X" * self.hdr_padding_len
         else:
@@ -103,16 +108,17 @@ class DataBlob:
         """
         addr = len(self.get_header(padding=False))
         self.hdr_padding_len = get_next_aligned_address(addr, 0x04) - addr
-        addr = len(self.get_header() + self.data)
+        addr += self.hdr_padding_len + len(self.data)
         self.padding_len = align_addr(addr) - addr
+        self.length = addr + self.padding_len
 
 
     def dump(self, silent:bool = True, base_addr:int = 0) -> bytes:
-        data = self.get_header() + self.data + b"X"*self.padding_len
+        data = b"".join((self.get_header(), self.data, b"X"*self.padding_len))   # payload copied once
         if silent is False:
             s = f"\t\tDatablob @ {base_addr + self.blob_offset:#x}, destination: {self.dest_addr:#x}, full size: {len(data):#x}, type={self.type.name}, last={self.is_last}/ next @ {base_addr + self.next:#x} / hdrpad: {self.hdr_padding_len}"
             if self.type == self.BlobType.TYPE_ZEROS:
-                s += f"""/ {struct.unpack("<I", self.data)[0]:,d} zeroed-out bytes"""
+                s += f"""/ {_U32.unpack(self.data)[0]:,d} zeroed-out bytes"""
             logging.debug(s)
         return data
 
@@ -181,8 +187,7 @@ class ModelBlob:
             first_blob_addr = self.db_list[0].get_offset()
         else:
             first_blob_addr = 0
-        data = b"MODEL_BLOB:" + struct.pack("<I", first_blob_addr)
-        data = struct.pack("<I", first_blob_addr)
+        data = _U32.pack(first_blob_addr)
         
         if padding is True:
             return data + b"X" * self.hdr_padding_len
@@ -190,17 +195,17 @@ class ModelBlob:
             return data
     
     def get_size(self) -> int:
-        return len(self.dump()) #self.get_end_address() - self.start_address
+        # Datablobs are contiguous after the header: no need to dump the whole model
+        return self.get_end_address() - self.start_address
     
     def dump(self, silent:bool=True, base_addr:int=0) -> bytes:
         mdl_start_addr = base_addr + self.start_address
         if silent is False:
             logging.debug(f"\tMODELBLOB @ {mdl_start_addr:#x} --> {base_addr+self.get_end_address():#x} (padding {self.hdr_padding_len})")
-        b = bytearray(self.get_header())
-        for k in self.db_list:
-            # all datablobs are aligned, just copy them side by side 
-            b += k.dump(silent, base_addr=mdl_start_addr)
-        return bytes(b)
+        parts = [self.get_header()]
+        # all datablobs are aligned, just copy them side by side 
+        parts.extend(k.dump(silent, base_addr=mdl_start_addr) for k in self.db_list)
+        return b"".join(parts)
 
 @dataclass
 class BTableRecord:
@@ -240,7 +245,7 @@ class BTableRecord:
         bytes_id = bytes(self.model_id, encoding ="ascii") + b"\0"
         bytes_id = bytes_id + b"*"*(32-len(bytes_id))
         #bytes_id = bytes(f"{self.model_id:>32s}", encoding="ascii")
-        hdr = bytes_id + struct.pack("<I", self.offset)
+        hdr = bytes_id + _U32.pack(self.offset)
         self.padding_len = align_addr(len(hdr)) - len(hdr)
         data = hdr + b"X" * self.padding_len
         if silent is False:
@@ -287,7 +292,7 @@ class BlobsTable:
         last_blob_idx = self.get_last_blob_idx()
         if last_blob_idx == - 1:
             # First blob
-            addr = len(self.dump())                         # Use relative addresses
+            addr = self.get_size()                          # Use relative addresses
             addr = align_addr(addr)
         else:
             k = self.table[last_blob_idx]
@@ -311,19 +316,25 @@ class BlobsTable:
         self.padding_len = align_addr(len(self.get_header())) - len(self.get_header())
     
     def get_header(self) -> bytes:
-        hdr = b"BLOBSTABLE:" + struct.pack("<B", self.padding_len)
         hdr = b""#struct.pack("<B", self.padding_len)
         return hdr
 
+    def get_size(self) -> int:
+        """
+        Size of the table dump (records have a fixed size)
+        """
+        return len(self.get_header()) + self.padding_len + sum(len(k.dump()) for k in self.table)
+
     def dump(self, silent:bool=True, base_addr:int=0) -> bytes:
         if silent is False:
             logging.debug(f"==== Table @ {base_addr:#x} ====")
-        img = bytearray()
-        img += self.get_header()
-        img += b"X" * self.padding_len
+        parts = [self.get_header(), b"X" * self.padding_len]
+        offset = len(parts[0]) + self.padding_len
         for k in self.table:
-            img += k.dump(silent, base_addr + len(img))
-        return img
+            rec = k.dump(silent, base_addr + offset)
+            parts.append(rec)
+            offset += len(rec)
+        return b"".join(parts)
     
     def get_models(self) -> Tuple[str, ModelBlob]:
         """
@@ -339,6 +350,8 @@ class BlobsTable:
 class GenuineAtonnBlocks:
     def __init__(self):
         self.data = {}
+        self._starts: List[int] = []     # sorted start addresses of the blocks (for overlaps lookups)
+        self._max_len = 0                # size of the largest block
     
     def add_block(self, address:int, data:bytes):
         # Sanity check
@@ -347,7 +360,10 @@ class GenuineAtonnBlocks:
         # ensure there is no overlap, or issue a warning
         if self.overlaps(address, len(data)):
             logging.error("Overlapping flash atonn blocks ! Overriding data - This will most likely fail at some point...")
+        if address not in self.data:
+            bisect.insort(self._starts, address)
         self.data[address] = bytes(data)
+        self._max_len = max(self._max_len, len(data))
     
     def overlaps(self, address:int, size:int) -> bool:
         """
@@ -366,10 +382,12 @@ class GenuineAtonnBlocks:
             is there an overlap between some of the blocks & the argument
         """
         max_addr = address + size
-        for k, v in self.data.items():
-            max_item_addr = k + len(v)
-            # overlap if address < k and max_addr > k or  max_item_addr > address > k 
-            if (address <= k and max_addr >= k) or (address >= k and address <= max_item_addr):
+        # Only blocks starting in ]address - largest block size, max_addr[ can overlap
+        lo = bisect.bisect_right(self._starts, address - self._max_len)
+        hi = bisect.bisect_left(self._starts, max_addr)
+        for k in self._starts[lo:hi]:
+            # overlap if [address, max_addr[ and [k, k + len[ intersect (contiguous blocks do not overlap)
+            if k + len(self.data[k]) > address:
                 return True
         return False
     
@@ -383,6 +401,7 @@ class FlashImage:
     A flash image should be flashed @ an address aligned with 0x4
     """
     BASE_ADDR = 0x7000_0000
+    FLASH_END_ADDR = 0x7400_0000    # Data in [BASE_ADDR, FLASH_END_ADDR[ is fetched from flash
     def __init__(self,base_addr:int=0x7000_0000):
         self.current_address = base_addr
         self.padding_len = 0
@@ -391,6 +410,7 @@ class FlashImage:
         self.table_offset = len(self.get_header())
         self.table:BlobsTable = BlobsTable()
         self.raw_data = GenuineAtonnBlocks()
+        self._init_files: Dict[Path, List[os.DirEntry]] = {}   # memory initializers path -> files (listed once)
 
     def add_network(self, filename:Path, memory_initializers_path:Path, net_name:str=None):
         """
@@ -414,10 +434,18 @@ class FlashImage:
         blb = self.table.add_blob(table_entry_name)
         cf = CFile(filename)
         mempool_offsets = cf.get_all_offsets()
-        mempool_suffixes = list(mempool_offsets.keys())
-        file_pfx = cf.get_cname()
-        for mf in memory_initializers_path.glob(f"**/{file_pfx}_*"):
-            if abs(mf.stat().st_mtime - cf.get_mtime()) < 10:
+        mempool_suffixes = set(mempool_offsets.keys())
+        file_pfx = os.path.normcase(cf.get_cname() + "_")     # glob matching is case-insensitive on Windows
+        c_mtime = cf.get_mtime()
+        # The memory initializers directory is only walked once for all the networks
+        init_files = self._init_files.get(memory_initializers_path)
+        if init_files is None:
+            init_files = self._init_files[memory_initializers_path] = list(iter_files(memory_initializers_path))
+        for entry in init_files:
+            if not os.path.normcase(entry.name).startswith(file_pfx):
+                continue
+            if abs(entry.stat().st_mtime - c_mtime) < 10:
+                mf = Path(entry.path)
                 mem_file_type = mf.suffixes[0][1:].upper()  # get memory pool from file extension
                 # try to ensure the file is really a memory "dump" file (as there is no way for the "c_file" to know exactly the name of the file...)
                 # This is done by looking whether the memory_pool suffix is part of the name.... (not 100% faultproof)
@@ -425,7 +453,7 @@ class FlashImage:
                     continue
                 offset = int(mempool_offsets[mem_file_type], base=16)
                 # Only add data that is not meant to be fetched from flash in the blob !
-                if (offset < 0x7000_0000) or (offset >= 0x7400_0000):
+                if (offset < self.BASE_ADDR) or (offset >= self.FLASH_END_ADDR):
                     blb.add_datablob(mf, offset)
                 else:
                     self.raw_data.add_block(address=offset, data=mf.read_bytes())
@@ -438,7 +466,7 @@ class FlashImage:
         Header :
             Address of the table [1 uint32_t]
         """
-        hdr = struct.pack("<B", self.table_offset)
+        hdr = _U8.pack(self.table_offset)
         if padding is True:
             hdr += b"X" * self.padding_len
         return hdr
@@ -446,9 +474,8 @@ class FlashImage:
     def dump(self, silent=False) -> bytes:
         if silent is False:
             logging.debug(f"==== START ====")
-        d = bytearray()
-        d += self.get_header()
-        d += self.table.dump(silent=silent, base_addr=self.current_address + len(d))
+        hdr = self.get_header()
+        parts = [hdr, self.table.dump(silent=silent, base_addr=self.current_address + len(hdr))]
         models_address = self.current_address
         if silent is False:
             logging.debug(f"==== Models details ====")
@@ -456,21 +483,21 @@ class FlashImage:
             # b is a BTable Record
             if silent is False:
                 logging.debug(f"\t== {bid:^32s} ==")
-            d += b.dump(silent=silent, base_addr=models_address)
+            parts.append(b.dump(silent=silent, base_addr=models_address))
         if silent is False:
             logging.debug(f"==== END ====")
-        return d
+        return b"".join(parts)
     
     def dump_hex(self, f:Path):
         ihex_bytes_field_len = 32
         total_size = 0
-        ih = intelhex.IntelHex()
+        blocks = []
         logging.debug(f"==== HEX contents ====")
-        build_image = bytes(self.dump(silent=True))
+        build_image = self.dump(silent=True)
         for addr, data in self.raw_data.get_data().items():
             total_size += len(data)
             logging.debug(f"""({"RAW DATA":^10s}) @ {addr:#10x} - {len(data)/1024:10,.3f} kB""")
-            ih.fromdict(bytes_to_dict(addr, data))
+            blocks.append((addr, data))
         if self.raw_data.overlaps(self.current_address, len(build_image)):
             logging.error("Overlapping flash atonn blocks with inner-memory blocks - Overriding data - This will most likely fail at some point...")
         
@@ -480,9 +507,9 @@ class FlashImage:
         ihex_size = total_size / ihex_bytes_field_len #nb of lines : all lines seems to contain 0x10 bytes of data
         ihex_size = ihex_size * (9 + ihex_bytes_field_len*2 + 2 + 2)    # 9= control chars 2=CRC 2=CR LF
         logging.debug(f"""({"TOTAL":^10s}) {total_size/1024:10,.3f} kB -- iHex size estimate: {ihex_size/1024:10,.3f} kB""")
-        ih.fromdict(bytes_to_dict(self.current_address,build_image))
+        blocks.append((self.current_address, build_image))     # written last: overrides the raw data
 
-        ih.write_hex_file(f, byte_count=ihex_bytes_field_len)
+        write_ihex(blocks, f, byte_count=ihex_bytes_field_len)
 
 def _main():
     data_dir = Path(__file__).parent / ".." / ".." / "DATA" / "my_test_fsbl_blobs"
@@ -0,0 +1,23 @@
+import os
+from pathlib import Path
+from typing import Iterator
+
+
+def iter_files(base_p: Path) -> Iterator[os.DirEntry]:
+    """
+    Yields the files below base_p, in the same order as Path.glob("**/*")
+    (directories are walked with os.scandir, which gives the file types without an extra stat;
+    symlinks to directories are not followed, as with glob, so a symlink loop cannot recurse forever)
+    The entries keep their stat() result once called
+    """
+    stack = [os.fspath(base_p)]
+    while stack:
+        subdirs = []
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+        # Keep the directory order (files of a directory, then its subdirectories)
+        stack.extend(reversed(subdirs))
@@ -1,6 +1,9 @@
 from __future__ import annotations
+import bisect
 from dataclasses import dataclass
+import os
 from pathlib import Path
+from typing import Iterable, Tuple
 
 class IHex():
     """
@@ -44,12 +47,110 @@ class IHex():
         int
             Size of the data in bytes
         """
+        # Sum size of data-records only: only the byte_count and record_type fields are parsed
+        # (fixed columns of the record, see _extract_line_fields)
         size = 0
-        with self.file.open() as f:
-            content = f.readlines()
-        # Sum size of data-records only
-        for l in content:
-            rec = self._extract_line_fields(l)
-            if rec.record_type == 0:  # 0 = data record
-                size = size + rec.byte_count
-        return size
\ No newline at end of file
+        for l in self.file.read_bytes().splitlines():
+            if l[7:9] == b"00":  # 0 = data record
+                size += int(l[1:3], 16)
+        return size
+
+def _ihex_record(rec_type:int, addr:int, payload:bytes) -> bytes:
+    """Formats one Intel-hex record (CRLF terminated, as objcopy does)"""
+    cs = -(len(payload) + (addr >> 8) + (addr & 0xFF) + rec_type + sum(payload)) & 0xFF
+    return f":{len(payload):02X}{addr:04X}{rec_type:02X}{payload.hex().upper()}{cs:02X}\r\n".encode("ascii")
+
+def raw_to_ihex(src:Path, dst:Path, offset:int = 0) -> int:
+    """
+    Converts a raw binary file into an Intel-hex file (same output as `objcopy -Ibinary -Oihex --change-addresses`)
+
+    Records are accumulated in a single bytearray and written at once.
+    As objcopy does, data below 1MiB is addressed with extended segment address records (type 02, with a start
+    segment address record (type 03)), and data above with extended linear address records (type 04, with a start
+    linear address record (type 05))
+
+    Returns
+    -------
+    int
+        Number of data bytes written in the hex file
+    """
+    data = Path(src).read_bytes()
+    buf = bytearray()
+    segbase = 0
+    extbase = 0
+    pos = 0
+    while pos < len(data):
+        addr = offset + pos
+        if addr > segbase + extbase + 0xFFFF:
+            # A new base address is needed
+            if extbase == 0 and addr <= 0xFFFFF:
+                segbase = addr & 0xF0000
+                buf += _ihex_record(0x02, 0, (segbase >> 4).to_bytes(2, "big"))
+            else:
+                if segbase != 0:
+                    # Clear the segment base before switching to linear addresses
+                    segbase = 0
+                    buf += _ihex_record(0x02, 0, bytes(2))
+                extbase = addr & 0xFFFF0000
+                buf += _ihex_record(0x04, 0, (extbase >> 16).to_bytes(2, "big"))
+        low = addr - (extbase + segbase)
+        # a data record cannot cross a 64KiB boundary
+        n = min(16, len(data) - pos, 0x10000 - low)
+        buf += _ihex_record(0x00, low, data[pos:pos + n])
+        pos += n
+    if offset:
+        # start address record (as emitted by objcopy)
+        if offset <= 0xFFFFF:
+            buf += _ihex_record(0x03, 0, bytes(((offset & 0xF0000) >> 12, 0, (offset >> 8) & 0xFF, offset & 0xFF)))
+        else:
+            buf += _ihex_record(0x05, 0, offset.to_bytes(4, "big"))
+    buf += b":00000001FF\r\n"
+    Path(dst).write_bytes(buf)
+    return len(data)
+
+def write_ihex(blocks:Iterable[Tuple[int, bytes]], dst:Path, byte_count:int = 16) -> None:
+    """
+    Writes data blocks (address, data) into an Intel-hex file (same output as `intelhex.IntelHex.write_hex_file`)
+    Blocks are written in order: when blocks overlap, the last one wins
+
+    Records never cross a 64KiB boundary, contiguous blocks are merged into the same records.
+    Extended linear address records are only emitted if some data is above 0xFFFF.
+    """
+    if not 1 <= byte_count <= 255:
+        raise ValueError(f"Wrong byte_count value: {byte_count}")
+    blocks = [(addr, data) for addr, data in blocks if len(data) != 0]
+    # Merge overlapping/contiguous blocks into segments, then copy the blocks in order (last one wins)
+    extents = []
+    for addr, data in sorted(blocks, key=lambda b: b[0]):
+        end = addr + len(data)
+        if extents and addr <= extents[-1][1]:
+            extents[-1][1] = max(extents[-1][1], end)
+        else:
+            extents.append([addr, end])
+    starts = [s for s, _ in extents]
+    segments = [bytearray(e - s) for s, e in extents]
+    for addr, data in blocks:
+        i = bisect.bisect_right(starts, addr) - 1
+        pos = addr - starts[i]
+        segments[i][pos:pos + len(data)] = data
+
+    eol = os.linesep.encode("ascii")    # as a text file
+    need_offset_record = bool(extents) and (extents[-1][1] - 1) > 0xFFFF
+    high = -1
+    buf = bytearray()
+    for start, seg in zip(starts, segments):
+        pos = 0
+        while pos < len(seg):
+            addr = start + pos
+            if need_offset_record and (addr >> 16) > high:
+                high = addr >> 16
+                cs = -(0x06 + (high >> 8) + (high & 0xFF)) & 0xFF
+                buf += f":02000004{high:04X}{cs:02X}".encode("ascii") + eol
+            low = addr & 0xFFFF
+            n = min(byte_count, len(seg) - pos, 0x10000 - low)
+            chunk = seg[pos:pos + n]
+            cs = -(n + (low >> 8) + (low & 0xFF) + sum(chunk)) & 0xFF
+            buf += f":{n:02X}{low:04X}00{chunk.hex().upper()}{cs:02X}".encode("ascii") + eol
+            pos += n
+    buf += b":00000001FF" + eol
+    Path(dst).write_bytes(buf)
@@ -1,11 +1,23 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
-import itertools
 from pathlib import Path
 from typing import Mapping, Optional
 import json
 import re
 
+# Sanitizers of badly written json: trailing commas before "]" or "}"
+_RE_TRAILING_COMMA_ARR = re.compile(r"\},(\s+)\]", re.MULTILINE | re.DOTALL)
+_RE_TRAILING_COMMA_OBJ = re.compile(r"\],(\s+)\}", re.MULTILINE | re.DOTALL)
+# Memory pool description, in the comments of the network.c file
+_RE_POOL = re.compile(r"""/\*\sglobal\spool\s(?P<NO>\d+)\sis\s(?P<SIZE>\?|\d+(?:\.\d+)?\s[KM]?B).*?
+                        postfix=(?P<POSTFIX>.*?)
+                        name=(?P<NAME>.*?)
+                        \s
+                        offset=(?P<OFFSET>0x[0-9A-Fa-f]+)
+                        .*?
+                        size=(?P<RAW_SIZE>\d+)\s+
+                        (?P<TYPE>[A-Z_]+).*?
+                        """, re.MULTILINE|re.VERBOSE|re.DOTALL)
 
 @dataclass
 class MPool():
@@ -23,8 +35,8 @@ class MPool():
         if self.filename is not None:
             self.data = Path(self.filename).read_text()
             # Sanitize badly written json.
-            self.data = re.sub("\},(\s+)\]", r"}\1]", self.data, flags = re.MULTILINE | re.DOTALL)
-            self.data = re.sub("\],(\s+)\}", r"]\1}", self.data, flags = re.MULTILINE | re.DOTALL)
+            self.data = _RE_TRAILING_COMMA_ARR.sub(r"}\1]", self.data)
+            self.data = _RE_TRAILING_COMMA_OBJ.sub(r"]\1}", self.data)
             self.data = json.loads(self.data)
             self.data["mempools"] = {k["fname"].upper():k for k in self.data["memory"]["mempools"]}
             self.data["mem_file_prefix"] = self.data["memory"]["mem_file_prefix"]
@@ -34,16 +46,7 @@ class MPool():
     def from_string(cls, data:str):
         obj = cls()
         mpools = obj.data["mempools"]
-        rex = re.compile(r"""/\*\sglobal\spool\s(?P<NO>\d+)\sis\s(?P<SIZE>\?|\d+(?:\.\d+)?\s[KM]?B).*?
-                        postfix=(?P<POSTFIX>.*?)
-                        name=(?P<NAME>.*?)
-                        \s
-                        offset=(?P<OFFSET>0x[0-9A-Fa-f]+)
-                        .*?
-                        size=(?P<RAW_SIZE>\d+)\s+
-                        (?P<TYPE>[A-Z_]+).*?
-                        """, re.MULTILINE|re.VERBOSE|re.DOTALL)
-        for m in rex.finditer(data):
+        for m in _RE_POOL.finditer(data):
             pool_pf = m.group("POSTFIX").strip().upper()
             mpools[pool_pf] = {
                                 "fname" : pool_pf,
@@ -78,10 +81,14 @@ class MPool():
         # Virtual mem pool name starts with a combination of the name of two other mempools
         li = list(mpools.keys())
         for v in li:
-            ll = [k for k in li if k != v]
-            c = ["_".join(c) for c in itertools.permutations(ll, 2)]
-            if v.startswith(tuple(c)):
-                del mpools[v]
+            # v starts with "<a>_<b>", a and b being two different pools (other than v)
+            for a in li:
+                if a == v or not v.startswith(a + "_"):
+                    continue
+                rest = v[len(a) + 1:]
+                if any(rest.startswith(b) for b in li if b != v and b != a):
+                    del mpools[v]
+                    break
         
         return obj
 